@@ -0,0 +1,146 @@
+import time
+
+import PySpin
+
+# GenICam features whose ranges depend on each other, in the order they have to be written:
+# pixel format limits binning and ROI, ROI limits frame rate and exposure, and frame rate can only be written with the trigger off.
+# Attributes not listed here are written after 'timing' and before 'trigger', in the order given.
+ATTR_STAGES = [
+    ('format', ['PixelFormat', 'AdcBitDepth', 'PixelSize']),
+    ('binning_roi', ['BinningSelector', 'BinningHorizontalMode', 'BinningVerticalMode', 'BinningHorizontal', 'BinningVertical',
+                     'DecimationSelector', 'DecimationHorizontalMode', 'DecimationVerticalMode', 'DecimationHorizontal', 'DecimationVertical',
+                     'ReverseX', 'ReverseY', 'Width', 'Height', 'OffsetX', 'OffsetY']),
+    ('timing', ['ExposureAuto', 'ExposureMode', 'ExposureTimeMode', 'ExposureTime',
+                'AcquisitionMode', 'AcquisitionFrameRateEnable', 'AcquisitionFrameRateAuto', 'AcquisitionFrameRate',
+                'GainAuto', 'GainSelector', 'Gain', 'BlackLevelSelector', 'BlackLevel', 'GammaEnable', 'Gamma']),
+    ('other', []),
+    ('trigger', ['LineSelector', 'LineMode', 'LineSource', 'LineInverter',
+                 'TriggerSelector', 'TriggerSource', 'TriggerActivation', 'TriggerOverlap', 'TriggerDelay', 'TriggerMode']),
+]
+
+class CamAttrApplier():
+    '''
+    Writes a dict of camera attributes in dependency order (see ATTR_STAGES), each value once, verified with one read-back.
+
+    Node type and enum entries are looked up once per attribute and cached, instead of calling get_info for every write.
+    The trigger is turned off for the whole pass (so frame rate can be written) and set at the end from the trigger stage.
+    '''
+    def __init__(self, cam, verbose=False):
+        '''
+        cam: simple_pyspin Camera
+        '''
+        self.cam = cam
+        self.verbose = verbose
+        self.info_cache = {}
+
+    def get_info(self, attr_name):
+        if attr_name not in self.info_cache:
+            info = self.cam.get_info(attr_name)
+            self.info_cache[attr_name] = {'type': info.get('type'), 'entries': info.get('entries')}
+        return self.info_cache[attr_name]
+
+    def order(self, attrs):
+        '''
+        Returns [(stage, attr_name, value)] in write order.
+        '''
+        stage_of = {}
+        for stage, names in ATTR_STAGES:
+            for name in names:
+                stage_of[name] = stage
+        ordered = []
+        for stage, names in ATTR_STAGES:
+            if stage == 'other':
+                ordered += [(stage, k, v) for k, v in attrs.items() if k not in stage_of]
+            else:
+                ordered += [(stage, k, attrs[k]) for k in names if k in attrs]
+        return ordered
+
+    def check_value(self, attr_name, value):
+        '''
+        Returns the value converted to the node's type, or raises ValueError.
+        '''
+        info = self.get_info(attr_name)
+        node_type = info['type']
+        if node_type == 'enum':
+            if value not in info['entries']:
+                raise ValueError(f'{value} is not one of {info["entries"]}')
+            return value
+        if node_type == 'float' and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        if node_type == 'int' and isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if node_type == 'string' and isinstance(value, str):
+            return value
+        if node_type == 'bool' and isinstance(value, bool):
+            return value
+        raise ValueError(f'cannot write {value!r} to a node of type {node_type}')
+
+    def write(self, attr_name, value):
+        '''
+        Writes one attribute and reads it back. Returns None on success, or a reason string.
+        '''
+        node = self.cam.camera_attributes.get(attr_name)
+        if node is None:
+            return 'not in camera'
+        try:
+            value = self.check_value(attr_name, value)
+            if not PySpin.IsWritable(node):
+                return 'not writable'
+            self.cam.__setattr__(attr_name, value)
+            read_back = self.cam.__getattr__(attr_name)
+        except (ValueError, PySpin.SpinnakerException) as e:
+            return str(e)
+        if isinstance(value, float):
+            # Float nodes are quantized by the camera (e.g. exposure steps); accept small differences.
+            if abs(read_back - value) > max(1e-6, 1e-3 * abs(value)):
+                return f'read back {read_back}'
+        elif read_back != value:
+            return f'read back {read_back}'
+        return None
+
+    def apply(self, attrs, n_retry=2):
+        '''
+        attrs: dict of {attr_name: value}
+        n_retry: extra passes over attributes that failed (e.g. still out of range because a later stage limits them)
+        Returns a report dict with 'written' ({attr_name: value}), 'failed' ({attr_name: reason}) and 'sec'.
+        A TriggerMode that was on and is only restored (not in attrs) is reported like the others.
+        '''
+        t0 = time.perf_counter()
+        ordered = self.order(attrs)
+
+        trigger_mode = None
+        if 'TriggerMode' in self.cam.camera_attributes and self.cam.__getattr__('TriggerMode') == 'On':
+            trigger_mode = 'On'
+            self.cam.__setattr__('TriggerMode', 'Off')
+        if 'TriggerMode' in attrs:
+            trigger_mode = attrs['TriggerMode']
+
+        written = {}
+        failed = {}
+        to_write = [(stage, k, v) for stage, k, v in ordered if k != 'TriggerMode']
+        for _ in range(1 + n_retry):
+            failed = {}
+            for stage, k, v in to_write:
+                reason = self.write(k, v)
+                if reason is None:
+                    written[k] = v
+                    if self.verbose:
+                        print(f'{stage}: {k} = {v}')
+                else:
+                    failed[k] = reason
+            to_write = [(stage, k, v) for stage, k, v in to_write if k in failed]
+            if len(to_write) == 0:
+                break
+
+        values = dict(attrs)
+        if trigger_mode is not None:
+            values['TriggerMode'] = trigger_mode
+            reason = self.write('TriggerMode', trigger_mode)
+            if reason is None:
+                written['TriggerMode'] = trigger_mode
+            else:
+                failed['TriggerMode'] = reason
+
+        for k, reason in failed.items():
+            print(f'Could not set {k} to {values[k]}: {reason}')
+        return {'written': written, 'failed': failed, 'sec': time.perf_counter() - t0}
@@ -0,0 +1,150 @@
+import os
+import atexit
+import shutil
+import subprocess
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+from jackfish.devices.cameras.ffmpeg_writer import get_ffmpeg_exe
+from jackfish.devices.cameras.raw_video import RawVideoWriter, RAW_EXT, transcode_raw_video
+
+# One pool is shared by every camera recording in chunked mode, so that chunks of a large camera
+# and a small one are interleaved over the same workers instead of each camera owning its own cores.
+_chunk_pool = None
+_chunk_pool_lock = threading.Lock()
+
+def get_chunk_pool(n_workers=None):
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            n_workers = n_workers if n_workers is not None else os.cpu_count()
+            _chunk_pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn'))
+            atexit.register(shutdown_chunk_pool)
+        return _chunk_pool
+
+def shutdown_chunk_pool(wait=True):
+    '''
+    Shuts the shared pool down (after the submitted chunks if wait); the next get_chunk_pool starts a new one.
+    '''
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is not None:
+            _chunk_pool.shutdown(wait=wait)
+            _chunk_pool = None
+
+class ChunkedVideoWriter():
+    '''
+    Writes raw frames into fixed-size chunk files, encodes the chunks in parallel on a shared process pool,
+    and losslessly concatenates the encoded chunks into path when closed.
+
+    Every chunk holds chunk_frames frames (a multiple of gop) and is encoded with a fixed GOP of gop frames,
+    so chunk boundaries fall on keyframes and the concat demuxer can join them with -c copy.
+    Exposes the same writeFrame/close surface as FFmpegWriter, plus close_async.
+    '''
+    def __init__(self, path, x, y, framerate, chunk_frames=1000, gop=100, preset='medium', crf=17, threads_per_chunk=1, ffmpeg_location=None, keep_chunks=False):
+        assert chunk_frames % gop == 0, 'chunk_frames should be a multiple of gop.'
+        self.path = path
+        self.x, self.y = x, y
+        self.framerate = framerate
+        self.chunk_frames = chunk_frames
+        self.gop = gop
+        self.preset = preset
+        self.crf = crf
+        self.threads_per_chunk = threads_per_chunk
+        self.ffmpeg_location = ffmpeg_location
+        self.keep_chunks = keep_chunks
+
+        self.chunk_dir = os.path.splitext(path)[0] + '_chunks'
+        os.makedirs(self.chunk_dir, exist_ok=True)
+
+        self.pool = get_chunk_pool()
+        self.futures = []
+        self.chunk_paths = []
+        self.chunk_writer = None
+        self.n_frames = 0
+        self.finish_thread = None
+        self.returncode = None
+
+    def open_chunk(self):
+        raw_path = os.path.join(self.chunk_dir, f'chunk_{len(self.chunk_paths):05d}{RAW_EXT}')
+        self.chunk_writer = RawVideoWriter(raw_path, self.x, self.y, self.framerate, extent_bytes=self.chunk_frames * self.x * self.y)
+        self.chunk_paths.append(raw_path)
+
+    def submit_chunk(self):
+        self.chunk_writer.close()
+        self.chunk_writer = None
+        raw_path = self.chunk_paths[-1]
+        self.futures.append(self.pool.submit(transcode_raw_video, raw_path,
+                                             out_path=os.path.splitext(raw_path)[0] + '.mp4',
+                                             ffmpeg_location=self.ffmpeg_location, preset=self.preset, crf=self.crf,
+                                             remove_raw=not self.keep_chunks, threads=self.threads_per_chunk, gop=self.gop))
+
+    def writeFrame(self, frame):
+        if self.chunk_writer is None:
+            self.open_chunk()
+        self.chunk_writer.writeFrame(frame)
+        self.n_frames += 1
+        if self.chunk_writer.n_frames >= self.chunk_frames:
+            self.submit_chunk()
+
+    def get_stats(self):
+        n_done = sum(future.done() for future in self.futures)
+        return {'frames_written': self.n_frames,
+                'chunks_submitted': len(self.futures),
+                'chunks_encoded': n_done,
+                'chunks_pending': len(self.futures) - n_done}
+
+    def close(self):
+        '''
+        Waits for every chunk to be encoded, then concatenates the chunks in order into self.path.
+        '''
+        self.close_async().join()
+        return self.returncode
+
+    def close_async(self, on_done=None):
+        '''
+        Submits the last chunk and finishes the file (waiting for the chunks and concatenating them) on a thread,
+        so that the caller does not wait for the encoding. Returns the thread; self.returncode is set when it is done.
+        on_done: function(returncode) called on that thread once the file is finished (or has failed)
+        '''
+        if self.finish_thread is None:
+            if self.chunk_writer is not None:
+                self.submit_chunk()
+
+            def finish():
+                try:
+                    self.returncode = self.concat_chunks()
+                except Exception as e: # e.g. a broken pool
+                    print(f'Finishing {self.path} failed ({e}); keeping chunks in {self.chunk_dir}.')
+                    self.returncode = -1
+                if on_done is not None:
+                    on_done(self.returncode)
+            # Not a daemon, so that a recording is still finished if the program exits meanwhile
+            self.finish_thread = threading.Thread(target=finish)
+            self.finish_thread.start()
+        return self.finish_thread
+
+    def concat_chunks(self):
+        returncodes = [future.result() for future in self.futures]
+        if any(returncode != 0 for returncode in returncodes):
+            print(f'{returncodes.count(0)}/{len(returncodes)} chunks of {self.path} encoded; keeping chunks in {self.chunk_dir}.')
+            return -1
+        if len(self.chunk_paths) == 0:
+            shutil.rmtree(self.chunk_dir)
+            return 0
+
+        list_path = os.path.join(self.chunk_dir, 'chunks.txt')
+        with open(list_path, 'w') as f:
+            for raw_path in self.chunk_paths:
+                # Relative entries are resolved against the list file's directory.
+                f.write(f"file '{os.path.splitext(os.path.basename(raw_path))[0]}.mp4'\n")
+        cmd = [get_ffmpeg_exe(self.ffmpeg_location), '-y', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', self.path]
+        returncode = subprocess.run(cmd, stdin=subprocess.DEVNULL).returncode
+
+        if returncode != 0:
+            print(f'Concatenating chunks into {self.path} failed with return code {returncode}; keeping chunks in {self.chunk_dir}.')
+        elif not self.keep_chunks:
+            shutil.rmtree(self.chunk_dir)
+        return returncode
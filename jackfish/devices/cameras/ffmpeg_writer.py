@@ -0,0 +1,154 @@
+import os
+import time
+import subprocess
+
+import numpy as np
+
+try:
+    import fcntl
+    F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031) # Linux only
+except ImportError:
+    fcntl = None
+
+def get_ffmpeg_exe(ffmpeg_location=None):
+    '''
+    ffmpeg_location: directory containing the ffmpeg binary, or None to use ffmpeg from PATH.
+    '''
+    if ffmpeg_location is not None and os.path.exists(os.path.join(ffmpeg_location, 'ffmpeg')):
+        return os.path.join(ffmpeg_location, 'ffmpeg')
+    return 'ffmpeg'
+
+def get_encoder_outputdict(encoder='libx264', preset=None, threads=None, gpu=-1, slices=16):
+    '''
+    ffmpeg output options for the encoders jackfish records with ('libx264', 'h264_nvenc' or lossless 'ffv1').
+    slices: number of FFV1 slices, which are encoded in parallel by the FFV1 threads
+    '''
+    if encoder == 'h264_nvenc':
+        return {'-vcodec': 'h264_nvenc', '-tune': 'hq', '-gpu': str(gpu)}
+    if encoder == 'ffv1':
+        # FFV1 version 3, intra-only, with per-slice CRCs so a damaged slice can be detected
+        return {'-vcodec': 'ffv1', '-level': '3', '-g': '1', '-slices': str(slices), '-slicecrc': '1',
+                '-threads': str(threads if threads is not None else 0)}
+    outputdict = {'-vcodec': 'libx264', '-tune': 'film'}
+    if preset is not None:
+        outputdict['-preset'] = preset
+    if threads is not None:
+        outputdict['-threads'] = str(threads)
+    return outputdict
+
+class FFmpegWriter():
+    '''
+    Pipes 8-bit mono frames to ffmpeg as rawvideo (-pix_fmt gray) input.
+
+    Frames are written as contiguous bytes with no per-frame shape/dtype conversion.
+    Replaces skvideo.io.FFmpegWriter with the same writeFrame/close surface, plus throughput and latency counters.
+    '''
+    def __init__(self, path, x, y, framerate, outputdict=None, ffmpeg_location=None, pipe_size=2**20, loglevel='error'):
+        '''
+        x, y: frame width and height; frames passed to writeFrame must be (y, x) uint8 arrays
+        outputdict: ffmpeg output options, e.g. {'-vcodec': 'libx264', '-tune': 'film'}
+        pipe_size: requested size of the stdin pipe buffer in bytes (capped by /proc/sys/fs/pipe-max-size)
+        '''
+        self.path = path
+        self.shape = (y, x)
+        self.frame_bytes = x * y
+        self.framerate = framerate
+
+        cmd = [get_ffmpeg_exe(ffmpeg_location), '-y', '-loglevel', loglevel,
+               '-f', 'rawvideo', '-pix_fmt', 'gray', '-video_size', f'{x}x{y}', '-framerate', str(framerate),
+               '-i', '-']
+        for k, v in (outputdict or {}).items():
+            cmd += [k, str(v)]
+        cmd.append(path)
+        self.cmd = cmd
+
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, bufsize=0)
+        self.stdin = self.proc.stdin
+        self.pipe_size = self.set_pipe_size(pipe_size)
+
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+        self.max_write_latency = 0.0
+        self.last_write_latency = 0.0
+        self.t_open = time.perf_counter()
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else None
+
+    def set_pipe_size(self, pipe_size):
+        if fcntl is None:
+            return None
+        try:
+            return fcntl.fcntl(self.stdin.fileno(), F_SETPIPE_SZ, pipe_size)
+        except OSError:
+            # Fall back to the largest size an unprivileged process may request.
+            try:
+                with open('/proc/sys/fs/pipe-max-size', 'r') as f:
+                    max_size = int(f.read())
+                return fcntl.fcntl(self.stdin.fileno(), F_SETPIPE_SZ, min(pipe_size, max_size))
+            except (OSError, ValueError):
+                return None
+
+    def writeFrame(self, frame):
+        assert frame.shape == self.shape and frame.dtype == np.uint8, f'Expected {self.shape} uint8 frame, got {frame.shape} {frame.dtype}.'
+        t = time.perf_counter()
+        view = memoryview(np.ascontiguousarray(frame)).cast('B') # no copy for already contiguous frames
+        n_written = 0
+        while n_written < self.frame_bytes:
+            n_written += self.stdin.write(view[n_written:])
+        latency = time.perf_counter() - t
+
+        self.frames_written += 1
+        self.bytes_written += n_written
+        self.write_time += latency
+        self.last_write_latency = latency
+        self.max_write_latency = max(self.max_write_latency, latency)
+
+    def close(self):
+        try:
+            self.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.proc.wait()
+        if returncode != 0:
+            print(f'ffmpeg writing {self.path} exited with return code {returncode}.')
+        return returncode
+
+    def get_output_bytes(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError: # not written yet, or not a file (e.g. '-')
+            return None
+
+    def get_ffmpeg_cpu_time(self):
+        '''
+        User + system CPU seconds used so far by the ffmpeg process (Linux only), or None.
+        '''
+        if self.clock_ticks is None:
+            return None
+        try:
+            with open(f'/proc/{self.proc.pid}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.clock_ticks # utime, stime
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def get_stats(self):
+        '''
+        bytes_per_s is the raw input rate into ffmpeg and output_bytes_per_s the encoded rate to disk.
+        ffmpeg_cpu is the average number of cores ffmpeg has kept busy: close to its thread count means
+        encoding is CPU-bound; low CPU with high write latency points at the disk instead.
+        '''
+        elapsed = time.perf_counter() - self.t_open
+        output_bytes = self.get_output_bytes()
+        cpu_time = self.get_ffmpeg_cpu_time()
+        return {'frames_written': self.frames_written,
+                'bytes_written': self.bytes_written,
+                'bytes_per_s': self.bytes_written / elapsed if elapsed > 0 else 0.0,
+                'mean_write_latency': self.write_time / self.frames_written if self.frames_written > 0 else 0.0,
+                'max_write_latency': self.max_write_latency,
+                'last_write_latency': self.last_write_latency,
+                'pipe_size': self.pipe_size,
+                'output_bytes': output_bytes,
+                'output_bytes_per_s': output_bytes / elapsed if output_bytes is not None and elapsed > 0 else None,
+                'compression_ratio': self.bytes_written / output_bytes if output_bytes else None,
+                'ffmpeg_cpu': cpu_time / elapsed if cpu_time is not None and elapsed > 0 else None}
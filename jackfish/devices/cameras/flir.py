@@ -2,39 +2,104 @@ import os
 import queue, threading
 import warnings
 import numpy as np
-import matplotlib.pyplot as plt
 import time
 # import cv2
 
 from PyQt5.QtCore import QThread, pyqtSignal
 
-import skvideo
-import skvideo.io
 import json
 from simple_pyspin import Camera
 import PySpin
 
+from jackfish.devices.cameras.frame_pool import FramePool
+from jackfish.devices.cameras.shm_encoder import EncoderProcess
+from jackfish.devices.cameras.ffmpeg_writer import FFmpegWriter, get_encoder_outputdict
+from jackfish.devices.cameras.segment_writer import SegmentedVideoWriter
+from jackfish.devices.cameras.chunked_writer import ChunkedVideoWriter
+from jackfish.devices.cameras.raw_video import RawVideoWriter, RAW_EXT, transcode_raw_video
+from jackfish.devices.cameras.image_events import FrameEventHandler
+from jackfish.devices.cameras.preview_tap import PreviewTap
+from jackfish.devices.cameras.frame_metadata import FRAME_INFO_FORMATS
+from jackfish.devices.cameras.attr_applier import CamAttrApplier
+from jackfish.devices.discovery import SPINNAKER_LOCK
+
 class FlirCam(QThread):
     # custom signal that a new frame is available
     new_frame_signal = pyqtSignal(bool)
 
+    # 'thread': encode in a writer thread of this process; 'process': encode in a separate process fed through shared memory
+    # 'raw': write unencoded frames to a memory-mapped file, to be transcoded after recording
+    # 'chunked': write raw chunks that are encoded in parallel on a process pool and concatenated at the end
+    RECORDING_MODES = ('thread', 'process', 'raw', 'chunked')
+    # 'h264': lossy H.264 (libx264 or h264_nvenc) in mp4; 'ffv1': lossless, sliced FFV1 in mkv
+    VIDEO_CODECS = ('h264', 'ffv1')
+    # 'event': frames are delivered by a PySpin image event handler; 'poll': frames are pulled with get_image in a loop
+    ACQUISITION_MODES = ('event', 'poll')
+    # Stream buffer counters read from the TL stream node map
+    STREAM_COUNTERS = ('StreamBufferUnderrunCount', 'StreamLostFrameCount', 'StreamOutputBufferCount')
+    # Chunk data enabled when control_attrs has "chunk_data": true; a list of ChunkSelector entries may be given instead
+    DEFAULT_CHUNK_DATA = ('FrameID', 'Timestamp', 'ExposureTime', 'Gain')
+
     def __init__(self, serial_number=0, attrs_json_fn=None, ffmpeg_location='/usr/bin', parent=None):
         '''
         serial_number: int or str (defalult: 0) If an int, the index of the camera to acquire. If a string, the serial number of the camera.
         '''
         super().__init__(parent)
 
-        self.cam = Camera(index=serial_number)
-        self.cam.init()
+        t_init = time.perf_counter()
+        with SPINNAKER_LOCK: # device discovery may be listing cameras on another thread
+            self.cam = Camera(index=serial_number)
+            self.cam.init()
         self.serial_number = self.get_cam_serial_number()
         self.release_trigger_on_start = False
         self.release_trigger_delay = 0
         self.restore_trigger_mode_on_stop = False
         self.writer_gpu = -1
-
-        if ffmpeg_location is not None and os.path.exists(ffmpeg_location):
-            skvideo.setFFmpegPath(ffmpeg_location)
-        else:
+        self.frame_pool_size = 256
+        self.encoder_stop_timeout = 30 # s to wait for the encoder process to drain before terminating it
+        self.backpressure_policy = 'block'
+        self.frame_pool = None
+        self.frame_pool_stats = None
+        self.recording_mode = 'thread'
+        self.encoder = None
+        self.encoder_status = None
+        self.encoder_lock = threading.Lock()
+        self.raw_extent_mb = 1024
+        self.transcode_raw_on_stop = False
+        self.segment_frames = None
+        self.segment_sec = None
+        self.late_frame_sec = None
+        self.frame_info_format = 'binary'
+        self.exposure_us = np.nan
+        self.gain_db = np.nan
+        self.chunk_data = None
+        self.chunk_fields = ()
+        self.preview_rate = 30
+        self.preview_downsample = 1
+        self.video_codec = 'h264'
+        self.ffv1_threads = 0
+        self.ffv1_slices = 16
+        self.chunk_frames = 1000
+        self.chunk_gop = 100
+        self.chunk_preset = 'medium'
+        self.total_frames_grabbed = 0
+        self.total_frames_written = 0
+        self.acquisition_mode = 'event'
+        self.event_handler = None
+        self.event_sink = None
+        self.event_lock = threading.Lock()
+        # Preview favors latency (only the newest frame matters); recording favors completeness (a deep queue absorbs host stalls).
+        self.preview_buffer_mode = 'NewestOnly'
+        self.preview_buffer_count = 3
+        self.record_buffer_mode = 'OldestFirst'
+        self.record_buffer_count = 200
+        self.stream_buffer_mode = None
+        self.stream_buffer_count = None
+        self.stream_baseline = {}
+        self.max_backlog = 0
+
+        self.ffmpeg_location = ffmpeg_location
+        if ffmpeg_location is None or not os.path.exists(ffmpeg_location):
             print(f'FFMPEG directory {ffmpeg_location} does not exist')
 
         if attrs_json_fn is not None:
@@ -48,10 +113,20 @@ class FlirCam(QThread):
             self.stop()
 
         assert self.dtype[-1] == '8', 'Data should be in proper bit depth'
+
+        # Frames for display are published here at a capped rate, never on the GUI thread.
+        self.preview_tap = PreviewTap(self.x, self.y, max_rate=self.preview_rate, downsample=self.preview_downsample)
+
+        if self.acquisition_mode == 'event':
+            self.register_event_handler()
+        self.reset_frame_counters()
         
         self.video_out_path = None
         self.t = time.time()
 
+        self.init_time = time.perf_counter() - t_init
+        print(f"Cam {str(self.serial_number)}: Initialized in {self.init_time:.2f} s.")
+
     def get_cam_serial_number(self):
         cam = self.cam
         serial_number_candidates = [x for x in cam.camera_attributes.keys() if "serialnumber" in x.lower()]
@@ -87,20 +162,22 @@ class FlirCam(QThread):
 
     def set_cam_attrs_from_json(self, json_path, n_repeat=3):
         '''
-        n_repeat: # of times to set the values, in case the first few passes don't set the values (e.g. dependence on other values)
+        camera_attrs are written once each in dependency order (see attr_applier.py) and verified by reading back.
+        n_repeat: max # of passes over attributes that could not be set (e.g. out of range until a later attribute is set)
         '''
         with open(json_path, 'r') as f:
             attrs_dict = json.load(f)
-        
+
+        applier = CamAttrApplier(self.cam)
         # Change offsets to 0 to ensure that change in binning can occur
-        self.set_cam_attr('OffsetX', 0)
-        self.set_cam_attr('OffsetY', 0)
+        applier.write('OffsetX', 0)
+        applier.write('OffsetY', 0)
 
+        self.attrs_report = None
         if 'camera_attrs' in attrs_dict:
-            cam_attrs = attrs_dict['camera_attrs']
-            for _ in range(n_repeat):
-                for (k,v) in cam_attrs.items():
-                    attr_value_result = self.set_cam_attr(k, v)
+            self.attrs_report = applier.apply(attrs_dict['camera_attrs'], n_retry=n_repeat-1)
+            print(f"Cam {str(self.serial_number)}: Wrote {len(self.attrs_report['written'])} attributes in {self.attrs_report['sec']:.2f} s"
+                  + (f", {len(self.attrs_report['failed'])} failed." if len(self.attrs_report['failed']) > 0 else "."))
         if 'control_attrs' in attrs_dict:
             control_attrs = attrs_dict['control_attrs']
             if 'ReleaseTriggerModeOnStart' in control_attrs and control_attrs['ReleaseTriggerModeOnStart']:
@@ -109,6 +186,65 @@ class FlirCam(QThread):
                 self.release_trigger_delay = control_attrs['ReleaseTriggerModeDelay']
             if 'writer_gpu' in control_attrs:
                 self.writer_gpu = control_attrs['writer_gpu']
+            if 'frame_pool_size' in control_attrs:
+                self.frame_pool_size = control_attrs['frame_pool_size']
+            if 'encoder_stop_timeout' in control_attrs:
+                self.encoder_stop_timeout = control_attrs['encoder_stop_timeout']
+            if 'backpressure_policy' in control_attrs:
+                assert control_attrs['backpressure_policy'] in FramePool.POLICIES, f"backpressure_policy should be one of {FramePool.POLICIES}"
+                self.backpressure_policy = control_attrs['backpressure_policy']
+            if 'recording_mode' in control_attrs:
+                assert control_attrs['recording_mode'] in self.RECORDING_MODES, f"recording_mode should be one of {self.RECORDING_MODES}"
+                self.recording_mode = control_attrs['recording_mode']
+            if 'raw_extent_mb' in control_attrs:
+                self.raw_extent_mb = control_attrs['raw_extent_mb']
+            if 'transcode_raw_on_stop' in control_attrs:
+                self.transcode_raw_on_stop = control_attrs['transcode_raw_on_stop']
+            if 'video_codec' in control_attrs:
+                assert control_attrs['video_codec'] in self.VIDEO_CODECS, f"video_codec should be one of {self.VIDEO_CODECS}"
+                self.video_codec = control_attrs['video_codec']
+            if 'ffv1_threads' in control_attrs:
+                self.ffv1_threads = control_attrs['ffv1_threads']
+            if 'ffv1_slices' in control_attrs:
+                self.ffv1_slices = control_attrs['ffv1_slices']
+            if 'chunk_frames' in control_attrs:
+                self.chunk_frames = control_attrs['chunk_frames']
+            if 'chunk_gop' in control_attrs:
+                self.chunk_gop = control_attrs['chunk_gop']
+            if 'chunk_preset' in control_attrs:
+                self.chunk_preset = control_attrs['chunk_preset']
+            if 'acquisition_mode' in control_attrs:
+                assert control_attrs['acquisition_mode'] in self.ACQUISITION_MODES, f"acquisition_mode should be one of {self.ACQUISITION_MODES}"
+                self.acquisition_mode = control_attrs['acquisition_mode']
+            if 'preview_buffer_mode' in control_attrs:
+                self.preview_buffer_mode = control_attrs['preview_buffer_mode']
+            if 'preview_buffer_count' in control_attrs:
+                self.preview_buffer_count = control_attrs['preview_buffer_count']
+            if 'record_buffer_mode' in control_attrs:
+                self.record_buffer_mode = control_attrs['record_buffer_mode']
+            if 'record_buffer_count' in control_attrs:
+                self.record_buffer_count = control_attrs['record_buffer_count']
+            if 'preview_rate' in control_attrs:
+                self.preview_rate = control_attrs['preview_rate']
+            if 'preview_downsample' in control_attrs:
+                self.preview_downsample = control_attrs['preview_downsample']
+            if 'chunk_data' in control_attrs:
+                chunk_data = control_attrs['chunk_data']
+                self.chunk_data = list(self.DEFAULT_CHUNK_DATA) if chunk_data is True else chunk_data if chunk_data else []
+            if 'frame_info_format' in control_attrs:
+                assert control_attrs['frame_info_format'] in FRAME_INFO_FORMATS, f"frame_info_format should be one of {FRAME_INFO_FORMATS}"
+                self.frame_info_format = control_attrs['frame_info_format']
+            if 'late_frame_ms' in control_attrs:
+                self.late_frame_sec = control_attrs['late_frame_ms'] / 1000
+            if 'segment_frames' in control_attrs:
+                self.segment_frames = control_attrs['segment_frames']
+            if 'segment_minutes' in control_attrs:
+                self.segment_sec = control_attrs['segment_minutes'] * 60
+
+        assert not (self.recording_mode == 'chunked' and self.video_codec != 'h264'), 'Chunked recording only supports h264.'
+
+        if self.chunk_data is not None:
+            self.configure_chunk_data(self.chunk_data)
 
         # Get key attributes from camera
         self.start(release_trigger_mode=False)
@@ -166,6 +302,8 @@ class FlirCam(QThread):
         
         print('Setting attribute.')
         cam.__setattr__(attr_name, attr_val)
+        if attr_name in ('ExposureTime', 'Gain'):
+            self.read_exposure_gain()
 
         if restore_trigger_mode:
             print(f'Restoring TriggerMode.')
@@ -229,36 +367,321 @@ class FlirCam(QThread):
         self.video_out_path = path
         print(f"Cam {str(self.serial_number)} video out path: {self.video_out_path}")
 
-    def grab_frame(self, wait=True):
+    def set_stream_buffers(self, handling_mode, buffer_count):
+        '''
+        Sets the stream buffer handling mode (e.g. 'NewestOnly', 'OldestFirst') and a manual buffer count,
+        clipped to what the camera allows. Must be called while acquisition is stopped.
+        See misc/lib_examples/PySpinExamples/BufferHandling.py.
+        '''
+        s_node_map = self.cam.cam.GetTLStreamNodeMap()
         try:
-            # PySpin image contains information about the frame, such as timestamp, gain, exposure, etc.
-            image = self.cam.get_image(wait=wait)
+            count_mode = PySpin.CEnumerationPtr(s_node_map.GetNode('StreamBufferCountMode'))
+            if PySpin.IsAvailable(count_mode) and PySpin.IsWritable(count_mode):
+                count_mode.SetIntValue(count_mode.GetEntryByName('Manual').GetValue())
+
+            count = PySpin.CIntegerPtr(s_node_map.GetNode('StreamBufferCountManual'))
+            if PySpin.IsAvailable(count) and PySpin.IsWritable(count):
+                count.SetValue(min(max(buffer_count, count.GetMin()), count.GetMax()))
+            self.stream_buffer_count = count.GetValue() if PySpin.IsAvailable(count) and PySpin.IsReadable(count) else None
+
+            mode = PySpin.CEnumerationPtr(s_node_map.GetNode('StreamBufferHandlingMode'))
+            if PySpin.IsAvailable(mode) and PySpin.IsWritable(mode):
+                entry = mode.GetEntryByName(handling_mode)
+                assert entry is not None and PySpin.IsReadable(entry), f'Unknown StreamBufferHandlingMode {handling_mode}'
+                mode.SetIntValue(entry.GetValue())
+            self.stream_buffer_mode = mode.GetCurrentEntry().GetSymbolic() if PySpin.IsAvailable(mode) and PySpin.IsReadable(mode) else None
+        except PySpin.SpinnakerException as e:
+            print(f"Cam {str(self.serial_number)}: Could not set stream buffers ({e}).")
+        print(f"Cam {str(self.serial_number)}: Stream buffers: {self.stream_buffer_mode}, {self.stream_buffer_count} buffers.")
 
-            frame_ts_cpu = time.time()            
-            frame = image.GetNDArray()
-            frame_ts = image.GetTimeStamp() / 1e9 # in seconds
-            frame_num = self.frame_num + 1
-            
-            self.frame_num = frame_num
-            self.frame = frame
-            self.frame_ts = frame_ts
+        self.stream_baseline = {name: self.read_stream_counter(name) for name in self.STREAM_COUNTERS}
+        self.max_backlog = 0
 
-            # Emit the signal with the new QImage
-            self.new_frame_signal.emit(True)
+    def read_stream_counter(self, name):
+        try:
+            node = PySpin.CIntegerPtr(self.cam.cam.GetTLStreamNodeMap().GetNode(name))
+            if PySpin.IsAvailable(node) and PySpin.IsReadable(node):
+                return node.GetValue()
+        except PySpin.SpinnakerException:
+            pass
+        return None
+
+    def sample_stream_backlog(self):
+        backlog = self.read_stream_counter('StreamOutputBufferCount')
+        if backlog is not None:
+            self.max_backlog = max(self.max_backlog, backlog)
+        return backlog
+
+    def get_stream_stats(self):
+        '''
+        underruns: frames the camera could not deliver because no empty buffer was available
+        lost: frames lost in transfer
+        buffers_in_use: filled buffers waiting to be picked up by the host
+        max_backlog: deepest buffers_in_use seen since the buffer policy was applied (sampled every 16 frames)
+        '''
+        def since_baseline(name):
+            value = self.read_stream_counter(name)
+            baseline = self.stream_baseline.get(name)
+            return value - baseline if value is not None and baseline is not None else value
+
+        return {'buffer_mode': self.stream_buffer_mode,
+                'buffer_count': self.stream_buffer_count,
+                'underruns': since_baseline('StreamBufferUnderrunCount'),
+                'lost': since_baseline('StreamLostFrameCount'),
+                'buffers_in_use': self.sample_stream_backlog(),
+                'max_backlog': self.max_backlog}
+
+    def configure_chunk_data(self, selectors):
+        '''
+        Enables chunk data for the given ChunkSelector entries (e.g. 'ExposureTime', 'Gain'), so that each image carries
+        them and process_image can read them without node reads. An empty list turns chunk mode off.
+        See misc/lib_examples/PySpinExamples/ChunkData.py.
+        '''
+        nodemap = self.cam.cam.GetNodeMap()
+        enabled = []
+        try:
+            chunk_mode_active = PySpin.CBooleanPtr(nodemap.GetNode('ChunkModeActive'))
+            if not PySpin.IsAvailable(chunk_mode_active) or not PySpin.IsWritable(chunk_mode_active):
+                print(f"Cam {str(self.serial_number)}: Chunk data is not supported.")
+                return
+            chunk_mode_active.SetValue(len(selectors) > 0)
+
+            chunk_selector = PySpin.CEnumerationPtr(nodemap.GetNode('ChunkSelector'))
+            chunk_enable = PySpin.CBooleanPtr(nodemap.GetNode('ChunkEnable'))
+            for selector in selectors:
+                entry = chunk_selector.GetEntryByName(selector)
+                if entry is None or not PySpin.IsReadable(entry):
+                    print(f"Cam {str(self.serial_number)}: Chunk {selector} is not available.")
+                    continue
+                chunk_selector.SetIntValue(entry.GetValue())
+                if PySpin.IsWritable(chunk_enable):
+                    chunk_enable.SetValue(True)
+                if PySpin.IsReadable(chunk_enable) and chunk_enable.GetValue():
+                    enabled.append(selector)
+        except PySpin.SpinnakerException as e:
+            print(f"Cam {str(self.serial_number)}: Could not configure chunk data ({e}).")
+        finally:
+            self.chunk_fields = tuple(enabled)
+        print(f"Cam {str(self.serial_number)}: Chunk data enabled: {', '.join(self.chunk_fields) if len(self.chunk_fields) > 0 else 'none'}.")
 
-            return frame, frame_num, frame_ts, frame_ts_cpu
-        
+    def read_frame_info(self, image):
+        '''
+        Returns (frame_id, frame_ts_ns, exposure_us, gain_db) of the image. Fields in the image's chunk data are taken from it;
+        the others come from the image itself (frame ID, timestamp) or from the cached exposure and gain.
+        '''
+        frame_id, frame_ts_ns = image.GetFrameID(), image.GetTimeStamp()
+        exposure_us, gain_db = self.exposure_us, self.gain_db
+        if len(self.chunk_fields) == 0:
+            return frame_id, frame_ts_ns, exposure_us, gain_db
+        try:
+            chunk_data = image.GetChunkData()
+            if 'FrameID' in self.chunk_fields:
+                frame_id = chunk_data.GetFrameID()
+            if 'Timestamp' in self.chunk_fields:
+                frame_ts_ns = chunk_data.GetTimestamp()
+            if 'ExposureTime' in self.chunk_fields:
+                exposure_us = chunk_data.GetExposureTime()
+            if 'Gain' in self.chunk_fields:
+                gain_db = chunk_data.GetGain()
+        except PySpin.SpinnakerException:
+            pass
+        return frame_id, frame_ts_ns, exposure_us, gain_db
+
+    def read_exposure_gain(self):
+        '''
+        Caches the current exposure (us) and gain (dB) for the frame metadata; NaN if the camera lacks them.
+        '''
+        attrs = self.cam.camera_attributes
+        self.exposure_us = self.cam.__getattr__('ExposureTime') if 'ExposureTime' in attrs and PySpin.IsReadable(attrs['ExposureTime']) else np.nan
+        self.gain_db = self.cam.__getattr__('Gain') if 'Gain' in attrs and PySpin.IsReadable(attrs['Gain']) else np.nan
+
+    def reset_frame_counters(self):
+        self.frame_num = 0
+        self.read_exposure_gain()
+        self.first_frame_id = None
+        self.last_frame_id = None
+        self.ts_offset_baseline = None
+        self.incomplete_since_last = 0
+        self.n_dropped_frames = 0
+        self.n_incomplete_frames = 0
+        self.n_late_frames = 0
+        self.n_timeouts = 0
+        self.timed_out = False
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.acq_t0 = time.perf_counter()
+        self.acq_cpu_time = 0.0
+        self.late_threshold = self.late_frame_sec if self.late_frame_sec is not None else 5 / self.framerate if self.framerate else 0.05
+
+    def check_frame_timing(self, frame_id, frame_ts, frame_ts_cpu):
+        '''
+        Uses the camera's frame ID and hardware timestamp to find frames that were lost before reaching the host
+        and frames that reached the host late. Returns (frame_num, gap, late), where frame_num counts from the first
+        frame ID of the acquisition and gap is the number of frames lost right before this one.
+        '''
+        if self.first_frame_id is None:
+            self.first_frame_id = frame_id
+            gap = 0
+        else:
+            gap = frame_id - self.last_frame_id - 1
+            if gap < 0: # frame ID counter was reset; continue numbering from the last frame
+                self.first_frame_id = frame_id - self.frame_num
+                gap = 0
+        self.n_dropped_frames += max(0, gap - self.incomplete_since_last)
+        self.incomplete_since_last = 0
+        self.last_frame_id = frame_id
+        frame_num = frame_id - self.first_frame_id + 1
+
+        # Host arrival minus hardware timestamp is constant up to transfer latency. The smallest offset seen is the baseline;
+        #   it is allowed to creep up by 100 ppm so that clock drift between camera and host is not reported as lateness.
+        offset = frame_ts_cpu - frame_ts
+        if self.ts_offset_baseline is None:
+            self.ts_offset_baseline = offset
+        else:
+            self.ts_offset_baseline = min(offset, self.ts_offset_baseline + 1e-4 * max(0, frame_ts - self.frame_ts))
+        latency = offset - self.ts_offset_baseline
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        late = latency > self.late_threshold
+        self.n_late_frames += int(late)
+
+        return frame_num, gap, int(late)
+
+    def get_frame_counters(self):
+        return {'hw_dropped': self.n_dropped_frames,
+                'incomplete': self.n_incomplete_frames,
+                'late': self.n_late_frames}
+
+    def get_acquisition_stats(self):
+        '''
+        acquisition_cpu: fraction of a core spent receiving frames (polling loop, or image event callbacks plus the idle waiting thread)
+        mean_latency/max_latency: host arrival delay in seconds relative to the fastest frame seen (absolute latency is unknown
+                                  because camera and host clocks are not synchronized)
+        timeouts: number of get_image timeouts (always 0 in 'event' mode)
+        '''
+        elapsed = time.perf_counter() - self.acq_t0
+        n_frames = max(self.frame_num, 1)
+        return {'acquisition_mode': 'event' if self.event_handler is not None else 'poll',
+                'acquisition_cpu': self.acq_cpu_time / elapsed if elapsed > 0 else 0.0,
+                'mean_latency': self.latency_sum / n_frames,
+                'max_latency': self.latency_max,
+                'timeouts': self.n_timeouts}
+
+    def register_event_handler(self):
+        if self.event_handler is not None:
+            return
+        try:
+            self.event_handler = FrameEventHandler(self.handle_image_event)
+            self.cam.cam.RegisterEventHandler(self.event_handler)
+            print(f"Cam {str(self.serial_number)}: Using image events for acquisition.")
+        except PySpin.SpinnakerException as e:
+            print(f"Cam {str(self.serial_number)}: Could not register image event handler ({e}); falling back to polling.")
+            self.event_handler = None
+
+    def unregister_event_handler(self):
+        if self.event_handler is not None:
+            self.cam.cam.UnregisterEventHandler(self.event_handler)
+            self.event_handler = None
+
+    def handle_image_event(self, image):
+        '''
+        Runs on Spinnaker's event thread for every image. Frames arriving while nothing is acquiring are ignored.
+        '''
+        frame_ts_cpu = time.time()
+        cpu_t0 = time.thread_time()
+        with self.event_lock:
+            if self.event_sink is not None:
+                pool, on_frame = self.event_sink
+                if self.process_image(image, frame_ts_cpu, pool=pool) is not None and on_frame is not None:
+                    on_frame()
+        self.acq_cpu_time += time.thread_time() - cpu_t0
+
+    def acquire_frames(self, is_running, pool=None, on_frame=None):
+        '''
+        Grabs frames (into pool, if given) until is_running() returns False, calling on_frame() after each frame.
+        In 'event' mode the frames are handled by handle_image_event and this thread only waits.
+        '''
+        cpu_t0 = time.thread_time()
+        if self.event_handler is not None:
+            sink = (pool, on_frame)
+            with self.event_lock:
+                self.event_sink = sink
+            while is_running():
+                time.sleep(0.05)
+            with self.event_lock:
+                if self.event_sink is sink:
+                    self.event_sink = None
+            self.acq_cpu_time += time.thread_time() - cpu_t0
+        else:
+            while is_running():
+                if self.grab_frame(pool=pool) is not None and on_frame is not None:
+                    on_frame()
+                cpu_t1 = time.thread_time()
+                self.acq_cpu_time += cpu_t1 - cpu_t0
+                cpu_t0 = cpu_t1
+
+    def grab_frame(self, wait=True, pool=None):
+        '''
+        Polls the camera for the next frame; used in 'poll' acquisition mode.
+        pool: FramePool or None. If given, the frame is copied into the pool for the writer; otherwise it is copied for preview only.
+        The PySpin image is released as soon as its pixels have been copied.
+        '''
+        try:
+            # PySpin image contains information about the frame, such as timestamp, gain, exposure, etc.
+            image = self.cam.get_image(wait=wait)
         except PySpin.SpinnakerException as e:
             # print(f'Error: {e}')
-            print(f"Cam {str(self.serial_number)}: Awaiting frame...")
+            self.n_timeouts += 1
+            if not self.timed_out: # report once per wait, not once per timeout
+                print(f"Cam {str(self.serial_number)}: Awaiting frame...")
+            self.timed_out = True
             return None
+        self.timed_out = False
+
+        result = self.process_image(image, time.time(), pool=pool)
+        image.Release()
+        return result
+
+    def process_image(self, image, frame_ts_cpu, pool=None):
+        '''
+        Copies the frame out of a PySpin image and updates the frame counters. Does not release the image.
+        Returns (frame, frame_num, frame_ts, frame_ts_cpu), or None if the image is incomplete. frame is None if the pool dropped it.
+        '''
+        if image.IsIncomplete():
+            self.n_incomplete_frames += 1
+            self.incomplete_since_last += 1
+            print(f"Cam {str(self.serial_number)}: Incomplete image (status {image.GetImageStatus()}), discarding.")
+            return None
+
+        frame_id, frame_ts_ns, exposure_us, gain_db = self.read_frame_info(image)
+        frame_ts = frame_ts_ns / 1e9 # in seconds
+        frame_num, gap, late = self.check_frame_timing(frame_id, frame_ts, frame_ts_cpu)
+        if gap > 0:
+            print(f"Cam {str(self.serial_number)}: {gap} frame(s) lost before frame {frame_num}.")
+
+        if pool is not None:
+            pool_idx = pool.put(image.GetNDArray(), frame_num, frame_ts_ns, frame_ts_cpu, exposure_us, gain_db, gap, late)
+            frame = pool.buffers[pool_idx] if pool_idx is not None else None
+        else:
+            frame = image.GetNDArray().copy()
+
+        self.frame_num = frame_num
+        if frame_num % 16 == 0:
+            self.sample_stream_backlog()
+        self.frame_ts = frame_ts
+
+        if frame is not None and self.preview_tap.offer(frame, frame_num):
+            # Signal that a new preview frame is available (at most preview_rate times per second)
+            self.new_frame_signal.emit(True)
+
+        return frame, frame_num, frame_ts, frame_ts_cpu
 
     def start_preview(self):
         def preview_callback():
-            while self.do_preview:
-                self.grab_frame()
+            self.acquire_frames(lambda: self.do_preview)
 
-        self.frame_num = 0
+        self.reset_frame_counters()
+        self.set_stream_buffers(self.preview_buffer_mode, self.preview_buffer_count)
         self.do_preview = True
         self.preview_thread = threading.Thread(target=preview_callback, daemon=True).start()
         print(f"Cam {str(self.serial_number)}: Camera preview started.")
@@ -267,61 +690,113 @@ class FlirCam(QThread):
         self.do_preview = False
         print(f"Cam {str(self.serial_number)}: Camera preview ended.")
 
-    def start_rec(self, use_nvenc=False):
+    def get_writer_outputdict(self, use_nvenc=False, encoder_opts=None):
+        '''
+        encoder_opts: dict with 'encoder', 'preset' and 'threads' (e.g. from EncoderScheduler). Overrides use_nvenc if given.
+        Both are ignored for the lossless ffv1 codec.
+        '''
+        if self.video_codec == 'ffv1':
+            return get_encoder_outputdict('ffv1', threads=self.ffv1_threads, slices=self.ffv1_slices)
+        if encoder_opts is None:
+            encoder_opts = {'encoder': 'h264_nvenc' if use_nvenc else 'libx264'}
+        return get_encoder_outputdict(encoder_opts['encoder'], encoder_opts.get('preset'), encoder_opts.get('threads'), gpu=self.writer_gpu)
+
+    def open_video_writer(self, path):
+        if self.recording_mode == 'raw':
+            return RawVideoWriter(path, self.x, self.y, self.framerate, extent_bytes=self.raw_extent_mb * 2**20)
+        if self.recording_mode == 'chunked':
+            return ChunkedVideoWriter(path, self.x, self.y, int(self.framerate), chunk_frames=self.chunk_frames, gop=self.chunk_gop,
+                                      preset=self.chunk_preset, ffmpeg_location=self.ffmpeg_location)
+        # fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        # return cv2.VideoWriter(path, fourcc, int(self.framerate), (self.x, self.y))
+        return FFmpegWriter(path, self.x, self.y, int(self.framerate),
+                            outputdict=self.writer_outputdict,
+                            ffmpeg_location=self.ffmpeg_location)
+
+    def get_rec_out_path(self):
+        stem = os.path.splitext(self.video_out_path)[0]
+        if self.recording_mode == 'raw':
+            return stem + RAW_EXT
+        if self.video_codec == 'ffv1':
+            return stem + '.mkv'
+        return self.video_out_path
+
+    def get_manifest_info(self):
+        return {'serial_number': str(self.serial_number), 'x': self.x, 'y': self.y, 'framerate': self.framerate,
+                'segment_frames': self.segment_frames, 'segment_sec': self.segment_sec}
+
+    def start_raw_transcode(self, raw_paths):
+        '''
+        Transcodes raw recordings (one per segment) to H.264 in a background thread.
+        '''
+        def transcode():
+            for raw_path in raw_paths:
+                transcode_raw_video(raw_path, out_path=os.path.splitext(raw_path)[0] + '.mp4', ffmpeg_location=self.ffmpeg_location)
+                print(f"Cam {str(self.serial_number)}: Finished transcoding {raw_path}.")
+        self.transcode_thread = threading.Thread(target=transcode, daemon=True)
+        self.transcode_thread.start()
+
+    def start_rec(self, use_nvenc=False, encoder_opts=None):
+        self.total_frames_grabbed = 0
+        self.total_frames_written = 0
+        self.reset_frame_counters()
+        self.set_stream_buffers(self.record_buffer_mode, self.record_buffer_count)
+        self.writer_outputdict = self.get_writer_outputdict(use_nvenc, encoder_opts)
+
+        if self.recording_mode == 'process':
+            self.start_rec_process()
+        else:
+            self.start_rec_thread()
+
+    def start_rec_thread(self):
+        def count_frame():
+            self.total_frames_grabbed += 1
+
         def rec_callback():
             # Assume this loop is fast enough to keep up with framerate
-            while self.do_record:
-                # grab_frame() returns None if there is no frame to grab
-                result = self.grab_frame()
-                if result is not None:
-                    frame, frame_num, frame_ts, frame_ts_cpu = result
-                    self.img_queue.put((frame, frame_num, frame_ts, frame_ts_cpu))
-                    self.total_frames_grabbed += 1
-                else:
-                    pass
+            self.acquire_frames(lambda: self.do_record, pool=self.frame_pool, on_frame=count_frame)
 
             print(f"Cam {str(self.serial_number)}: Record thread completed.")
 
         def rec_writer():
             print(f"Cam {str(self.serial_number)}: writer started")
-            while self.do_record or self.img_queue.qsize()>0:
-                # If recording has ended and still writing, OR queue size is abnormally large (> 1000)
-                if not self.do_record or self.img_queue.qsize() > 1000:
-                    print(f"Cam {str(self.serial_number)}: Number of images remaining in queue: {self.img_queue.qsize()}")
+            while self.do_record or self.frame_pool.qsize()>0:
+                # If recording has ended and still writing, OR more than half of the pool is waiting to be written
+                if not self.do_record or self.frame_pool.qsize() > self.frame_pool.n_buffers // 2:
+                    print(f"Cam {str(self.serial_number)}: Number of images remaining in queue: {self.frame_pool.qsize()}")
+                # Blocking get is important for preventing the writer thread from taking too much
+                #    clock time away from other threads
+                item = self.frame_pool.get(timeout=(1/self.framerate)*10)
+                if item is None:
+                    continue
+                pool_idx, frame_info = item
                 try:
-                    # block=True is important for preventing the writer thread from taking too much
-                    #    clock time away from other threads
-                    frame, frame_num, frame_ts, frame_ts_cpu = self.img_queue.get(block=True, timeout=(1/self.framerate)*10)
-
                     # frame_color = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
                     # self.video_writer.write(frame_color)
-                    self.video_writer.writeFrame(frame)
-                    self.frame_info_writer.write(f'{frame_num} {frame_ts} {frame_ts_cpu}\n')
+                    self.video_writer.write(self.frame_pool.buffers[pool_idx], *frame_info)
                     self.total_frames_written += 1
-                except queue.Empty:
-                    continue
                 except Exception as e:
                     print(f"Cam {str(self.serial_number)}: Unexpected exception {e} occurred in rec writer thread.")
+                finally:
+                    self.frame_pool.release(pool_idx)
 
             self.video_writer.close()
-            self.frame_info_writer.close()
         
             print(f"Cam {str(self.serial_number)}: Writer thread completed.")
             print(f"Cam {str(self.serial_number)}: Total frames grabbed = {self.total_frames_grabbed}")
             print(f"Cam {str(self.serial_number)}: Total frames written = {self.total_frames_written}")
+            print(f"Cam {str(self.serial_number)}: Frames dropped by pool ({self.frame_pool.policy}) = {self.frame_pool.n_dropped}")
+            print(f"Cam {str(self.serial_number)}: Pool high-water mark = {self.frame_pool.high_water}/{self.frame_pool.n_buffers}")
 
-        self.total_frames_grabbed = 0
-        self.total_frames_written = 0
+            if self.recording_mode == 'raw' and self.transcode_raw_on_stop:
+                self.start_raw_transcode(self.video_writer.video_paths)
 
-        self.img_queue = queue.Queue()
-        # fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        # self.video_writer = cv2.VideoWriter(self.video_out_path, fourcc, int(self.framerate), (self.x, self.y))
-        self.video_writer = skvideo.io.FFmpegWriter(self.video_out_path, 
-                                                    inputdict={'-framerate':str(int(self.framerate))}, 
-                                                    outputdict={'-vcodec': 'h264_nvenc', '-tune': 'hq', '-gpu': str(self.writer_gpu)} if use_nvenc else {'-vcodec': 'libx264', '-tune': 'film'})
-        self.frame_info_writer = open(self.video_out_path.replace('.mp4', '.txt'), 'w')
+        self.frame_pool = FramePool(self.x, self.y, n_buffers=self.frame_pool_size, policy=self.backpressure_policy)
+        self.encoder_status = None # left over from an earlier recording in 'process' mode
+        self.video_writer = SegmentedVideoWriter(self.get_rec_out_path(), self.open_video_writer, 
+                                                 segment_frames=self.segment_frames, segment_sec=self.segment_sec,
+                                                 info=self.get_manifest_info(), frame_info_format=self.frame_info_format)
 
-        self.frame_num = 0
         self.do_record = True
         self.record_thread = threading.Thread(target=rec_callback, daemon=True)
         self.writer_thread = threading.Thread(target=rec_writer, daemon=True)
@@ -329,13 +804,94 @@ class FlirCam(QThread):
         self.record_thread.start()
         print(f"Cam {str(self.serial_number)}: Camera record started.")
     
+    def start_rec_process(self):
+        def count_frame():
+            self.total_frames_grabbed += 1
+
+        def rec_callback():
+            # The grab thread only copies into the shared ring; encoding happens in the encoder process.
+            self.acquire_frames(lambda: self.do_record, pool=self.frame_pool, on_frame=count_frame)
+
+            print(f"Cam {str(self.serial_number)}: Record thread completed.")
+            print(f"Cam {str(self.serial_number)}: Waiting for encoder process to drain {self.frame_pool.qsize()} frames.")
+
+            self.encoder.stop(timeout=self.encoder_stop_timeout)
+            with self.encoder_lock:
+                self.encoder_status = self.encoder.poll()
+                self.get_frame_pool_stats()
+                self.frame_pool = None
+                self.encoder.close()
+                self.encoder = None
+            self.total_frames_written = self.encoder_status['frames_written']
+
+            if self.encoder_status['exitcode'] != 0:
+                print(f"Cam {str(self.serial_number)}: Encoder process exited with code {self.encoder_status['exitcode']}.")
+                if self.encoder_status['error'] is not None:
+                    print(self.encoder_status['error'])
+            print(f"Cam {str(self.serial_number)}: Total frames grabbed = {self.total_frames_grabbed}")
+            print(f"Cam {str(self.serial_number)}: Total frames written = {self.total_frames_written}")
+            print(f"Cam {str(self.serial_number)}: Frames dropped by shared ring = {self.frame_pool_stats['frames_dropped']}")
+            print(f"Cam {str(self.serial_number)}: Ring high-water mark = {self.frame_pool_stats['high_water']}/{self.frame_pool_stats['n_buffers']}")
+
+        self.encoder = EncoderProcess(self.x, self.y, self.frame_pool_size, self.get_rec_out_path(), int(self.framerate),
+                                      self.writer_outputdict, ffmpeg_location=self.ffmpeg_location,
+                                      segment_frames=self.segment_frames, segment_sec=self.segment_sec, 
+                                      manifest_info=self.get_manifest_info(), frame_info_format=self.frame_info_format)
+        self.encoder_status = None
+        self.video_writer = None # the video writer lives in the encoder process; its stats come with the encoder status
+        self.frame_pool = self.encoder.ring
+        self.encoder.start()
+
+        self.do_record = True
+        self.record_thread = threading.Thread(target=rec_callback, daemon=True)
+        self.record_thread.start()
+        print(f"Cam {str(self.serial_number)}: Camera record started (encoder pid {self.encoder.process.pid}).")
+
+    def get_frame_pool_stats(self):
+        if self.frame_pool is not None:
+            self.frame_pool_stats = self.frame_pool.get_stats()
+        return self.frame_pool_stats
+
+    def get_encoder_status(self):
+        '''
+        Status of the encoder process in 'process' recording mode; None in 'thread' mode.
+        '''
+        with self.encoder_lock:
+            if self.encoder is not None:
+                self.encoder_status = self.encoder.poll()
+            return self.encoder_status
+
+    def get_rec_stats(self):
+        stats = {'frames_grabbed': self.total_frames_grabbed,
+                 'frames_written': self.total_frames_written}
+        stats.update(self.get_frame_counters())
+        stats['acquisition'] = self.get_acquisition_stats()
+        stats['stream'] = self.get_stream_stats()
+        with self.encoder_lock:
+            pool_stats = self.get_frame_pool_stats()
+        if pool_stats is not None:
+            stats.update(pool_stats)
+        video_writer = getattr(self, 'video_writer', None)
+        writer_stats = video_writer.get_stats() if video_writer is not None else None
+        if writer_stats is not None:
+            stats['writer'] = writer_stats
+        encoder_status = self.get_encoder_status()
+        if encoder_status is not None:
+            stats['frames_written'] = encoder_status['frames_written']
+            stats['encoder'] = encoder_status
+            if encoder_status.get('writer') is not None:
+                stats['writer'] = encoder_status['writer']
+        return stats
+
     def stop_rec(self):
         print(f"Cam {str(self.serial_number)}: Stopping camera record.")
 
         self.do_record = False
 
     def close(self):
-        self.cam.close()
+        self.unregister_event_handler()
+        with SPINNAKER_LOCK:
+            self.cam.close()
 
 # t = time.time()
 # cam = JFCam()
@@ -0,0 +1,138 @@
+import os
+import json
+
+import numpy as np
+
+FRAME_META_EXT = '.jfmeta'
+FRAME_META_MAGIC = b'JFMETA01'
+FRAME_META_HEADER_SIZE = 512
+# One record per frame. frame_num is the hardware frame ID counted from the first frame of the recording (see FlirCam.check_frame_timing).
+FRAME_META_DTYPE = np.dtype([('frame_num', '<i8'),
+                             ('hw_ns', '<i8'),         # camera timestamp in ns
+                             ('host_time', '<f8'),     # host time (s since epoch) at arrival
+                             ('exposure_us', '<f8'),
+                             ('gain_db', '<f8'),
+                             ('gap', '<i4'),           # frames lost right before this one
+                             ('late', '<i4')])         # 1 if the frame reached the host late
+
+FRAME_INFO_FORMATS = ('binary', 'txt')
+
+class FrameMetadataWriter():
+    '''
+    Writes per-frame metadata as fixed-size binary records (FRAME_META_DTYPE) after a small JSON header.
+
+    Records are collected in a block and written with a single call every block_frames frames.
+    '''
+    def __init__(self, path, block_frames=1024):
+        self.path = path
+        self.block = np.zeros(block_frames, dtype=FRAME_META_DTYPE)
+        self.n_block = 0
+        self.n_frames = 0
+
+        self.file = open(path, 'wb')
+        header = {'dtype': FRAME_META_DTYPE.descr, 'header_size': FRAME_META_HEADER_SIZE}
+        header_bytes = FRAME_META_MAGIC + json.dumps(header).encode()
+        assert len(header_bytes) <= FRAME_META_HEADER_SIZE, 'Frame metadata header is too large.'
+        self.file.write(header_bytes.ljust(FRAME_META_HEADER_SIZE, b' '))
+
+    def write(self, frame_num, frame_ts_ns, frame_ts_cpu, exposure_us=np.nan, gain_db=np.nan, gap=0, late=0):
+        self.block[self.n_block] = (frame_num, frame_ts_ns, frame_ts_cpu, exposure_us, gain_db, gap, late)
+        self.n_block += 1
+        self.n_frames += 1
+        if self.n_block == len(self.block):
+            self.flush()
+
+    def write_records(self, records):
+        '''
+        records: structured array of FRAME_META_DTYPE, written after any buffered records
+        '''
+        self.flush()
+        self.file.write(np.ascontiguousarray(records, dtype=FRAME_META_DTYPE).tobytes())
+        self.n_frames += len(records)
+
+    def flush(self):
+        self.file.write(self.block[:self.n_block].tobytes())
+        self.file.flush()
+        self.n_block = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class TxtFrameInfoWriter():
+    '''
+    Writes one text line per frame: frame_num frame_ts(s) frame_ts_cpu gap late
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+
+    def write(self, frame_num, frame_ts_ns, frame_ts_cpu, exposure_us=np.nan, gain_db=np.nan, gap=0, late=0):
+        self.file.write(f'{frame_num} {frame_ts_ns / 1e9} {frame_ts_cpu} {gap} {late}\n')
+
+    def close(self):
+        self.file.close()
+
+def frame_info_path(video_path, frame_info_format='binary'):
+    return os.path.splitext(video_path)[0] + (FRAME_META_EXT if frame_info_format == 'binary' else '.txt')
+
+def open_frame_info_writer(path, frame_info_format='binary'):
+    assert frame_info_format in FRAME_INFO_FORMATS, f'frame_info_format should be one of {FRAME_INFO_FORMATS}'
+    if frame_info_format == 'binary':
+        return FrameMetadataWriter(path)
+    return TxtFrameInfoWriter(path)
+
+def load_frame_metadata(path):
+    '''
+    Returns a read-only structured memmap of FRAME_META_DTYPE records (an empty array for an empty file).
+    The record count is inferred from the file size, so files from an interrupted recording can still be read.
+    '''
+    with open(path, 'rb') as f:
+        header_bytes = f.read(FRAME_META_HEADER_SIZE)
+    assert header_bytes.startswith(FRAME_META_MAGIC), f'{path} is not a jackfish frame metadata file.'
+    header = json.loads(header_bytes[len(FRAME_META_MAGIC):].decode().strip())
+    dtype = np.dtype([tuple(field) for field in header['dtype']])
+    n_frames = (os.path.getsize(path) - header['header_size']) // dtype.itemsize
+    if n_frames == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=header['header_size'], shape=(n_frames,))
+
+def convert_frame_info_txt(txt_path, out_path=None):
+    '''
+    Converts a .txt frame info file (frame_num frame_ts frame_ts_cpu [gap late]) to the binary format.
+    Exposure and gain are not in the text files and are stored as NaN. Returns the output path.
+    An empty file (a recording during which no frame arrived) gives a header-only file.
+    '''
+    if out_path is None:
+        out_path = os.path.splitext(txt_path)[0] + FRAME_META_EXT
+    rows = np.loadtxt(txt_path, ndmin=2) if os.path.getsize(txt_path) > 0 else np.zeros((0, 3))
+    if rows.size == 0: # e.g. only blank lines
+        rows = np.zeros((0, 3))
+    records = np.zeros(len(rows), dtype=FRAME_META_DTYPE)
+    records['frame_num'] = rows[:, 0]
+    records['hw_ns'] = np.round(rows[:, 1] * 1e9)
+    records['host_time'] = rows[:, 2]
+    records['exposure_us'] = np.nan
+    records['gain_db'] = np.nan
+    if rows.shape[1] >= 5:
+        records['gap'] = rows[:, 3]
+        records['late'] = rows[:, 4]
+    writer = FrameMetadataWriter(out_path)
+    writer.write_records(records)
+    writer.close()
+    return out_path
+
+def convert_frame_info_dir(dir_path):
+    '''
+    Converts every .txt frame info file in dir_path that has a video next to it.
+    A file that cannot be converted is reported and skipped. Returns the output paths of the converted files.
+    '''
+    stems = {os.path.splitext(fn)[0] for fn in os.listdir(dir_path) if fn.endswith(('.mp4', '.mkv', '.jfraw'))}
+    txt_paths = sorted(os.path.join(dir_path, fn) for fn in os.listdir(dir_path) if fn.endswith('.txt') and os.path.splitext(fn)[0] in stems)
+    out_paths = []
+    for txt_path in txt_paths:
+        try:
+            out_paths.append(convert_frame_info_txt(txt_path))
+        except Exception as e:
+            print(f'Could not convert {txt_path}: {e}')
+    return out_paths
@@ -0,0 +1,102 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+class FramePool():
+    '''
+    Fixed-size pool of preallocated frame buffers shared between a grab thread and a writer thread.
+
+    Frames are copied into a free buffer on put() and handed to the consumer in order by get().
+    The consumer must release() the buffer index once it is done with the frame.
+    When every buffer is in use, the backpressure policy decides what happens to the next frame:
+        'block':       wait (up to block_timeout seconds) for the consumer to release a buffer
+        'drop_oldest': overwrite the oldest frame that has not been consumed yet
+        'drop_newest': discard the incoming frame
+    '''
+    POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+    def __init__(self, x, y, n_buffers=256, policy='block', dtype=np.uint8, block_timeout=1.0):
+        '''
+        x, y: frame width and height (frames are stored as (y, x) arrays)
+        n_buffers: number of preallocated frame buffers
+        '''
+        assert policy in self.POLICIES, f'Unknown backpressure policy {policy}; choose from {self.POLICIES}.'
+        assert n_buffers > 0, 'Frame pool needs at least one buffer.'
+
+        self.policy = policy
+        self.n_buffers = n_buffers
+        self.block_timeout = block_timeout
+
+        self.buffers = np.zeros((n_buffers, y, x), dtype=dtype) # zeros, not empty, so that pages are touched up front
+
+        self.free = deque(range(n_buffers))
+        self.ready = deque()
+        self.cond = threading.Condition()
+
+        self.n_put = 0
+        self.n_dropped = 0
+        self.high_water = 0
+
+    def _acquire_free(self):
+        # Must be called with self.cond held. Returns a free buffer index or None if the frame should be dropped.
+        if len(self.free) == 0:
+            if self.policy == 'drop_newest':
+                return None
+            elif self.policy == 'drop_oldest':
+                if len(self.ready) > 0:
+                    idx, _ = self.ready.popleft()
+                    self.free.append(idx)
+                    self.n_dropped += 1
+            else: # block
+                if not self.cond.wait_for(lambda: len(self.free) > 0, timeout=self.block_timeout):
+                    return None
+        if len(self.free) == 0: # drop_oldest with every buffer held by the consumer
+            return None
+        return self.free.popleft()
+
+    def put(self, frame, *info):
+        '''
+        Copies frame into the pool and queues it with info for the consumer.
+        Returns the buffer index, or None if the frame was dropped.
+        '''
+        with self.cond:
+            idx = self._acquire_free()
+            if idx is None:
+                self.n_dropped += 1
+                return None
+
+        # The buffer is in neither deque at this point, so the copy can happen outside the lock.
+        np.copyto(self.buffers[idx], frame)
+
+        with self.cond:
+            self.ready.append((idx, info))
+            self.n_put += 1
+            self.high_water = max(self.high_water, self.n_buffers - len(self.free))
+            self.cond.notify_all()
+        return idx
+
+    def get(self, timeout=None):
+        '''
+        Returns (idx, info) of the oldest queued frame, or None on timeout.
+        The frame itself is self.buffers[idx] and stays valid until release(idx).
+        '''
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.ready) > 0, timeout=timeout):
+                return None
+            return self.ready.popleft()
+
+    def release(self, idx):
+        with self.cond:
+            self.free.append(idx)
+            self.cond.notify_all()
+
+    def qsize(self):
+        return len(self.ready)
+
+    def get_stats(self):
+        return {'n_buffers': self.n_buffers,
+                'policy': self.policy,
+                'frames_put': self.n_put,
+                'frames_dropped': self.n_dropped,
+                'high_water': self.high_water}
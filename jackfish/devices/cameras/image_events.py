@@ -0,0 +1,19 @@
+import PySpin
+
+class FrameEventHandler(PySpin.ImageEventHandler):
+    '''
+    Image event handler that hands every image to a callback on Spinnaker's event thread
+    (see misc/lib_examples/PySpinExamples/ImageEvents.py).
+
+    Nothing runs between frames, so waiting for a trigger costs no CPU. While the handler is registered,
+    images are delivered only to it; GetNextImage / get_image would time out.
+    '''
+    def __init__(self, on_image):
+        '''
+        on_image: function(image) called for every image. The image is released by Spinnaker after the call returns.
+        '''
+        super(FrameEventHandler, self).__init__()
+        self.on_image = on_image
+
+    def OnImageEvent(self, image):
+        self.on_image(image)
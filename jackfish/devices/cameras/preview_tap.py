@@ -0,0 +1,60 @@
+import time
+
+import numpy as np
+
+class PreviewTap():
+    '''
+    Publishes the latest frame for display at no more than max_rate frames/s.
+
+    The acquisition thread calls offer() for every frame. Offers that are not due return after a clock check.
+    A due offer copies the frame, subsampled by downsample, into the back one of two buffers, then publishes
+    the buffer index with a single tuple assignment. The display reads the front buffer with latest()
+    without taking a lock. Neither side ever waits on the other.
+    '''
+    def __init__(self, x, y, max_rate=30, downsample=1, dtype=np.uint8):
+        '''
+        x, y: full frame width and height
+        downsample: keep every downsample-th pixel in each dimension
+        '''
+        self.max_rate = max_rate
+        self.downsample = downsample
+        self.shape = (len(range(0, y, downsample)), len(range(0, x, downsample)))
+        self.buffers = [np.zeros(self.shape, dtype=dtype) for _ in range(2)]
+        self.enabled = True
+
+        self.published = (0, 0, 0) # (sequence number, buffer index, frame number)
+        self.t_last = 0.0
+        self.n_published = 0
+
+    def offer(self, frame, frame_num):
+        '''
+        Returns True if the frame was published.
+        '''
+        if not self.enabled:
+            return False
+        t = time.perf_counter()
+        if t - self.t_last < 1 / self.max_rate:
+            return False
+        self.t_last = t
+
+        seq, idx, _ = self.published
+        back = 1 - idx
+        np.copyto(self.buffers[back], frame[::self.downsample, ::self.downsample])
+        self.published = (seq + 1, back, frame_num)
+        self.n_published += 1
+        return True
+
+    def latest(self):
+        '''
+        Returns (frame_num, copy of the latest published frame), or None if nothing has been published yet
+        or the buffer was overwritten while it was being copied (the next call will get a newer frame).
+        '''
+        seq, idx, frame_num = self.published
+        if seq == 0:
+            return None
+        frame = self.buffers[idx].copy()
+        # Once the producer has published again, buffer idx is its back buffer and may be being overwritten,
+        # so the copy is only known to be intact if nothing was published meanwhile.
+        if self.published[0] != seq:
+            return None
+        return frame_num, frame
@@ -0,0 +1,134 @@
+import os
+import json
+import subprocess
+
+import numpy as np
+
+from jackfish.devices.cameras.ffmpeg_writer import get_ffmpeg_exe
+
+RAW_EXT = '.jfraw'
+RAW_MAGIC = b'JFRAW001'
+RAW_HEADER_SIZE = 4096 # keeps frame data page-aligned
+
+class RawVideoWriter():
+    '''
+    Writes frames straight into a memory-mapped raw file: a fixed-size header followed by contiguous (y, x) frames.
+
+    The file is grown in large extents so that writing a frame is a single copy into mapped memory.
+    Exposes the same writeFrame/close surface as FFmpegWriter.
+    '''
+    def __init__(self, path, x, y, framerate, dtype=np.uint8, extent_bytes=2**30):
+        '''
+        extent_bytes: the file is grown (and remapped) in chunks of approximately this many bytes
+        '''
+        self.path = path
+        self.shape = (y, x)
+        self.dtype = np.dtype(dtype)
+        self.framerate = framerate
+        self.frame_bytes = x * y * self.dtype.itemsize
+        self.extent_frames = max(1, int(extent_bytes // self.frame_bytes))
+
+        self.n_frames = 0
+        self.extent_start = 0
+        self.extent = None
+
+        self.file = open(path, 'w+b')
+        self.write_header()
+        self.grow()
+
+    def write_header(self):
+        header = {'shape': list(self.shape),
+                  'dtype': self.dtype.str,
+                  'framerate': self.framerate,
+                  'n_frames': self.n_frames,
+                  'header_size': RAW_HEADER_SIZE}
+        header_bytes = RAW_MAGIC + json.dumps(header).encode()
+        assert len(header_bytes) <= RAW_HEADER_SIZE, 'Raw video header is too large.'
+        self.file.seek(0)
+        self.file.write(header_bytes.ljust(RAW_HEADER_SIZE, b' '))
+        self.file.flush()
+
+    def grow(self):
+        '''
+        Extends the file by one extent and maps only the new extent.
+        '''
+        if self.extent is not None:
+            self.extent.flush()
+            del self.extent
+        self.extent_start = self.n_frames
+        self.file.truncate(RAW_HEADER_SIZE + (self.extent_start + self.extent_frames) * self.frame_bytes)
+        self.extent = np.memmap(self.file, dtype=self.dtype, mode='r+',
+                                offset=RAW_HEADER_SIZE + self.extent_start * self.frame_bytes,
+                                shape=(self.extent_frames,) + self.shape)
+
+    def writeFrame(self, frame):
+        if self.n_frames - self.extent_start >= self.extent_frames:
+            self.grow()
+        self.extent[self.n_frames - self.extent_start] = frame
+        self.n_frames += 1
+
+    def close(self):
+        if self.extent is not None:
+            self.extent.flush()
+            del self.extent
+            self.extent = None
+        # Trim the unused part of the last extent and record the final frame count.
+        self.file.truncate(RAW_HEADER_SIZE + self.n_frames * self.frame_bytes)
+        self.write_header()
+        self.file.close()
+
+def read_raw_header(path):
+    with open(path, 'rb') as f:
+        header_bytes = f.read(RAW_HEADER_SIZE)
+    assert header_bytes.startswith(RAW_MAGIC), f'{path} is not a jackfish raw video.'
+    return json.loads(header_bytes[len(RAW_MAGIC):].decode().strip())
+
+def load_raw_video(path):
+    '''
+    Returns (frames, header), where frames is a read-only (n_frames, y, x) memmap.
+    n_frames is inferred from the file size so that files from an interrupted recording can still be read.
+    '''
+    header = read_raw_header(path)
+    shape = tuple(header['shape'])
+    dtype = np.dtype(header['dtype'])
+    frame_bytes = int(np.prod(shape)) * dtype.itemsize
+    n_frames = (os.path.getsize(path) - header['header_size']) // frame_bytes
+    if n_frames == 0:
+        return np.zeros((0,) + shape, dtype=dtype), header
+    frames = np.memmap(path, dtype=dtype, mode='r', offset=header['header_size'], shape=(n_frames,) + shape)
+    return frames, header
+
+def transcode_raw_video(raw_path, out_path=None, ffmpeg_location=None, preset='medium', crf=17, remove_raw=False, threads=0, gop=None):
+    '''
+    Encodes a raw video to H.264 with libx264 (threads=0 uses all available cores).
+    gop: fixed keyframe interval in frames, or None for the libx264 default.
+    ffmpeg reads the raw file directly; the header is skipped with -skip_initial_bytes.
+    Returns the ffmpeg return code.
+    '''
+    header = read_raw_header(raw_path)
+    y, x = header['shape']
+    assert np.dtype(header['dtype']) == np.uint8, 'Only 8-bit raw videos can be transcoded.'
+    if out_path is None:
+        out_path = os.path.splitext(raw_path)[0] + '.mp4'
+    cmd = [get_ffmpeg_exe(ffmpeg_location), '-y', '-loglevel', 'error',
+           '-f', 'rawvideo', '-pix_fmt', 'gray', '-video_size', f'{x}x{y}', '-framerate', str(header['framerate']),
+           '-skip_initial_bytes', str(header['header_size']),
+           '-i', raw_path,
+           '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-threads', str(threads), '-pix_fmt', 'yuv420p']
+    if gop is not None:
+        cmd += ['-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0']
+    cmd.append(out_path)
+    print(f'Transcoding {raw_path} -> {out_path}')
+    returncode = subprocess.run(cmd, stdin=subprocess.DEVNULL).returncode
+    if returncode != 0:
+        print(f'Transcoding {raw_path} failed with return code {returncode}.')
+    elif remove_raw:
+        os.remove(raw_path)
+    return returncode
+
+def transcode_raw_dir(dir_path, **kwargs):
+    '''
+    Transcodes every raw video in dir_path, one at a time (each ffmpeg already uses all cores).
+    '''
+    raw_paths = sorted(os.path.join(dir_path, fn) for fn in os.listdir(dir_path) if fn.endswith(RAW_EXT))
+    return {raw_path: transcode_raw_video(raw_path, **kwargs) for raw_path in raw_paths}
@@ -0,0 +1,104 @@
+import numpy as np
+
+from jackfish.devices.cameras.frame_metadata import frame_info_path, open_frame_info_writer
+from jackfish.devices.segment_manifest import SegmentManifest, segment_path, manifest_path
+
+class SegmentedVideoWriter():
+    '''
+    Writes video frames and their frame info lines, rotating to a new pair of files every
+    segment_frames frames and/or segment_sec seconds. Frame numbers continue across segments.
+
+    Without segment_frames or segment_sec, a single video is written at video_out_path and no manifest is made.
+    '''
+    def __init__(self, video_out_path, open_video_writer, segment_frames=None, segment_sec=None, info=None, frame_info_format='binary'):
+        '''
+        video_out_path: path of the whole recording; segments are named <stem>_seg000<ext>
+        open_video_writer: function(path) -> writer with writeFrame/close (path has the extension of video_out_path)
+        info: recording-level information for the manifest
+        frame_info_format: 'binary' (.jfmeta, see frame_metadata.py) or 'txt'
+        '''
+        self.frame_info_format = frame_info_format
+        self.video_out_path = video_out_path
+        self.open_video_writer = open_video_writer
+        self.segment_frames = segment_frames
+        self.segment_sec = segment_sec
+        self.segmented = segment_frames is not None or segment_sec is not None
+
+        self.manifest = SegmentManifest(manifest_path(video_out_path), info) if self.segmented else None
+        self.video_paths = []
+        self.finishing = [] # threads finishing closed segments (writers with close_async)
+        self.video_writer = None
+        self.frame_info_writer = None
+        if not self.segmented:
+            # Open right away, so that the files exist even if no frame ever arrives.
+            self.open_segment(None, None)
+
+    def open_segment(self, frame_num, frame_ts_cpu):
+        if self.segmented:
+            video_path = segment_path(self.video_out_path, len(self.video_paths))
+        else:
+            video_path = self.video_out_path
+        info_path = frame_info_path(video_path, self.frame_info_format)
+
+        self.video_writer = self.open_video_writer(video_path)
+        self.frame_info_writer = open_frame_info_writer(info_path, self.frame_info_format)
+        self.video_paths.append(video_path)
+
+        self.segment_n_frames = 0
+        self.segment_start_time = frame_ts_cpu
+        if self.segmented:
+            self.manifest.open_segment({'video': video_path, 'frame_info': info_path}, frame_num, frame_ts_cpu)
+
+    def close_segment(self):
+        self.frame_info_writer.close()
+        video_writer = self.video_writer
+        self.video_writer = None
+        self.frame_info_writer = None
+        # Writers that finish the file in the background (ChunkedVideoWriter) must not hold up the next segment;
+        # their segment is marked complete in the manifest only once the file is done.
+        if hasattr(video_writer, 'close_async'):
+            on_done = None
+            if self.segmented:
+                index = self.manifest.close_segment(self.last_frame_num, self.last_frame_ts_cpu, pending=True)
+                on_done = lambda returncode: self.manifest.finish_segment(index, returncode)
+            self.finishing.append(video_writer.close_async(on_done=on_done))
+        else:
+            returncode = video_writer.close()
+            if self.segmented:
+                self.manifest.close_segment(self.last_frame_num, self.last_frame_ts_cpu, returncode=returncode)
+
+    def segment_full(self, frame_ts_cpu):
+        if self.segment_frames is not None and self.segment_n_frames >= self.segment_frames:
+            return True
+        if self.segment_sec is not None and frame_ts_cpu - self.segment_start_time >= self.segment_sec:
+            return True
+        return False
+
+    def write(self, frame, frame_num, frame_ts_ns, frame_ts_cpu, exposure_us=np.nan, gain_db=np.nan, gap=0, late=0):
+        '''
+        frame_ts_ns: camera timestamp in ns
+        gap: number of frames lost right before this one; late: 1 if the frame reached the host late
+        '''
+        if self.video_writer is None:
+            self.open_segment(frame_num, frame_ts_cpu)
+        elif self.segmented and self.segment_full(frame_ts_cpu):
+            self.close_segment()
+            self.open_segment(frame_num, frame_ts_cpu)
+
+        self.video_writer.writeFrame(frame)
+        self.frame_info_writer.write(frame_num, frame_ts_ns, frame_ts_cpu, exposure_us, gain_db, gap, late)
+        self.segment_n_frames += 1
+        self.last_frame_num = frame_num
+        self.last_frame_ts_cpu = frame_ts_cpu
+
+    def close(self):
+        if self.video_writer is not None:
+            self.close_segment()
+        for thread in self.finishing:
+            thread.join()
+        self.finishing = []
+
+    def get_stats(self):
+        if self.video_writer is not None and hasattr(self.video_writer, 'get_stats'):
+            return self.video_writer.get_stats()
+        return None
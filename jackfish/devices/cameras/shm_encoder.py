@@ -0,0 +1,228 @@
+import time
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from jackfish.devices.cameras.ffmpeg_writer import FFmpegWriter
+from jackfish.devices.cameras.segment_writer import SegmentedVideoWriter
+from jackfish.devices.cameras.frame_metadata import FRAME_META_DTYPE
+
+# Header layout (int64): [write index, read index, frames written by worker, worker heartbeat (ms)]
+N_HEADER = 4
+# Video writer stats (see FFmpegWriter.get_stats) published by the worker as float64, NaN for None
+WRITER_STAT_KEYS = ('frames_written', 'bytes_written', 'bytes_per_s', 'mean_write_latency', 'max_write_latency', 'last_write_latency',
+                    'pipe_size', 'output_bytes', 'output_bytes_per_s', 'compression_ratio', 'ffmpeg_cpu')
+WRITER_INT_STATS = ('frames_written', 'bytes_written', 'pipe_size', 'output_bytes')
+WRITER_STATS_INTERVAL = 0.5 # s
+
+class SharedFrameRing():
+    '''
+    Single-producer / single-consumer ring of (y, x) frames living in shared memory.
+
+    The producer (grab thread) only copies a frame into the next slot and bumps the write index.
+    The consumer (encoder process) reads slots between the read and write indices and bumps the read index.
+    If the ring is full, the incoming frame is dropped so that the grab thread never waits on the encoder.
+    '''
+    def __init__(self, x=None, y=None, n_slots=256, dtype=np.uint8, name=None):
+        '''
+        x, y, n_slots: create a new ring with n_slots frames of shape (y, x).
+        name: attach to an existing ring created by another process instead.
+        '''
+        self.dtype = np.dtype(dtype)
+        if name is None:
+            self.x, self.y, self.n_slots = x, y, n_slots
+            self.shm = shared_memory.SharedMemory(create=True, size=self._nbytes())
+            self.owner = True
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False) # Python >= 3.13
+            except TypeError:
+                # The spawned encoder process shares the creator's resource tracker, so registering again on attach is
+                # harmless: the creator's unlink unregisters the segment, and the tracker still cleans up if the creator crashes.
+                self.shm = shared_memory.SharedMemory(name=name)
+            header = np.ndarray((3,), dtype=np.int64, buffer=self.shm.buf)
+            self.x, self.y, self.n_slots = (int(v) for v in header)
+            self.owner = False
+        self.name = self.shm.name
+
+        offset = 3 * 8
+        self.shape_header = np.ndarray((3,), dtype=np.int64, buffer=self.shm.buf)
+        self.header = np.ndarray((N_HEADER,), dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += N_HEADER * 8
+        self.writer_stats = np.ndarray((len(WRITER_STAT_KEYS),), dtype=np.float64, buffer=self.shm.buf, offset=offset)
+        offset += len(WRITER_STAT_KEYS) * 8
+        # Per-slot frame metadata, in the same record layout as the .jfmeta sidecar
+        self.info = np.ndarray((self.n_slots,), dtype=FRAME_META_DTYPE, buffer=self.shm.buf, offset=offset)
+        offset += self.n_slots * FRAME_META_DTYPE.itemsize
+        self.buffers = np.ndarray((self.n_slots, self.y, self.x), dtype=self.dtype, buffer=self.shm.buf, offset=offset)
+
+        if self.owner:
+            self.shape_header[:] = (self.x, self.y, self.n_slots)
+            self.header[:] = 0
+            self.writer_stats[:] = np.nan
+
+        self.n_put = 0
+        self.n_dropped = 0
+        self.high_water = 0
+
+    def _nbytes(self):
+        return (3 + N_HEADER + len(WRITER_STAT_KEYS)) * 8 + self.n_slots * FRAME_META_DTYPE.itemsize + self.n_slots * self.y * self.x * self.dtype.itemsize
+
+    ### Producer side ###
+    def put(self, frame, frame_num, frame_ts_ns, frame_ts_cpu, exposure_us=np.nan, gain_db=np.nan, gap=0, late=0):
+        '''
+        Returns the slot index, or None if the ring was full and the frame was dropped.
+        '''
+        w = int(self.header[0])
+        r = int(self.header[1])
+        if w - r >= self.n_slots:
+            self.n_dropped += 1
+            return None
+        idx = w % self.n_slots
+        np.copyto(self.buffers[idx], frame)
+        self.info[idx] = (frame_num, frame_ts_ns, frame_ts_cpu, exposure_us, gain_db, gap, late)
+        self.header[0] = w + 1 # publish only after the slot is fully written
+        self.n_put += 1
+        self.high_water = max(self.high_water, w + 1 - r)
+        return idx
+
+    def qsize(self):
+        return int(self.header[0]) - int(self.header[1])
+
+    ### Consumer side ###
+    def peek(self):
+        '''
+        Returns the slot index of the oldest unread frame, or None if the ring is empty.
+        '''
+        r = int(self.header[1])
+        if r >= int(self.header[0]):
+            return None
+        return r % self.n_slots
+
+    def advance(self):
+        self.header[1] += 1
+
+    def publish_writer_stats(self, stats):
+        if stats is not None:
+            self.writer_stats[:] = [np.nan if stats.get(k) is None else stats[k] for k in WRITER_STAT_KEYS]
+
+    def get_writer_stats(self):
+        '''
+        Returns the stats last published by the worker, or None if it has not published any yet.
+        '''
+        values = self.writer_stats.copy()
+        if np.isnan(values[0]):
+            return None
+        return {k: None if np.isnan(v) else int(v) if k in WRITER_INT_STATS else v for k, v in zip(WRITER_STAT_KEYS, values.tolist())}
+
+    def get_stats(self):
+        return {'n_buffers': self.n_slots,
+                'policy': 'drop_newest',
+                'frames_put': self.n_put,
+                'frames_dropped': self.n_dropped,
+                'high_water': self.high_water}
+
+    def close(self):
+        # Views into the buffer must be released before the shared memory can be closed.
+        del self.shape_header, self.header, self.writer_stats, self.info, self.buffers
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def encoder_worker(ring_name, video_out_path, framerate, outputdict, ffmpeg_location, segment_frames, segment_sec, manifest_info, frame_info_format, stop_event, error_queue):
+    '''
+    Entry point of the encoder process. Drains the ring into ffmpeg and the frame info file until stop_event is set and the ring is empty.
+    '''
+    ring = None
+    try:
+        ring = SharedFrameRing(name=ring_name)
+        open_video_writer = lambda path: FFmpegWriter(path, ring.x, ring.y, framerate, outputdict=outputdict, ffmpeg_location=ffmpeg_location)
+        video_writer = SegmentedVideoWriter(video_out_path, open_video_writer, segment_frames=segment_frames, segment_sec=segment_sec, info=manifest_info,
+                                            frame_info_format=frame_info_format)
+
+        idle_sleep = min(0.5 / framerate, 0.005)
+        t_stats = 0
+        while True:
+            ring.header[3] = int(time.time() * 1000)
+            if time.time() - t_stats >= WRITER_STATS_INTERVAL:
+                ring.publish_writer_stats(video_writer.get_stats())
+                t_stats = time.time()
+            idx = ring.peek()
+            if idx is None:
+                if stop_event.is_set():
+                    break
+                time.sleep(idle_sleep)
+                continue
+            video_writer.write(ring.buffers[idx], *ring.info[idx].item())
+            ring.advance()
+            ring.header[2] += 1
+
+        ring.publish_writer_stats(video_writer.get_stats())
+        video_writer.close()
+    except Exception:
+        error_queue.put(traceback.format_exc())
+        raise
+    finally:
+        if ring is not None:
+            ring.close()
+
+class EncoderProcess():
+    '''
+    Owns the shared frame ring and the encoder process for one camera.
+    '''
+    def __init__(self, x, y, n_slots, video_out_path, framerate, outputdict, ffmpeg_location=None, segment_frames=None, segment_sec=None, manifest_info=None, frame_info_format='binary'):
+        # spawn, not fork: the parent holds Qt and Spinnaker state that must not be duplicated.
+        ctx = mp.get_context('spawn')
+        self.ring = SharedFrameRing(x, y, n_slots=n_slots)
+        self.stop_event = ctx.Event()
+        self.error_queue = ctx.Queue()
+        self.error = None
+        self.terminated = False
+        self.process = ctx.Process(target=encoder_worker,
+                                   args=(self.ring.name, video_out_path, framerate, outputdict, ffmpeg_location,
+                                         segment_frames, segment_sec, manifest_info, frame_info_format, self.stop_event, self.error_queue),
+                                   daemon=True)
+
+    def start(self):
+        self.process.start()
+
+    def stop(self, timeout=30):
+        '''
+        Asks the worker to finish the queued frames and waits up to timeout s for it to exit.
+        A worker that is still running then (e.g. a hung ffmpeg) is terminated; poll() reports it as 'terminated'.
+        '''
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+            self.terminated = True
+            self.error = f'Encoder did not finish within {timeout} s ({self.ring.qsize()} frames left) and was terminated.'
+        return self.poll()
+
+    def close(self):
+        self.ring.close()
+
+    def poll(self):
+        '''
+        Returns a dict describing the worker: whether it is alive, its exit code, the last error, frames written, lag
+        and the stats of its video writer ('writer', see FFmpegWriter.get_stats).
+        '''
+        while not self.error_queue.empty():
+            self.error = self.error_queue.get_nowait()
+        if self.terminated and self.error is None:
+            self.error = 'Encoder was terminated.'
+        heartbeat = int(self.ring.header[3])
+        return {'alive': self.process.is_alive(),
+                'exitcode': self.process.exitcode,
+                'terminated': self.terminated,
+                'error': self.error,
+                'frames_written': int(self.ring.header[2]),
+                'lag_frames': self.ring.qsize(),
+                'writer': self.ring.get_writer_stats(),
+                'heartbeat_age': time.time() - heartbeat / 1000 if heartbeat > 0 else None}
+
+    def crashed(self):
+        return self.process.exitcode is not None and self.process.exitcode != 0
@@ -0,0 +1,159 @@
+import os
+import json
+
+import numpy as np
+
+DAQ_DATA_MAGIC = b'JFDAQB01'
+DAQ_DATA_HEADER_SIZE = 4096
+# 'float64' / 'float32': binary blocks (see daq_block_dtype); 'txt': the original format, one text line of samples per scan
+DAQ_RECORD_FORMATS = ('float64', 'float32', 'txt')
+
+def daq_block_dtype(n_channels, block_scans, sample_dtype='float64'):
+    '''
+    One block per stream read: scan number of its first scan, host time (s since epoch) at which it was read,
+    number of valid scans, and the samples, channel-major. Scans past n_scans (in a short last block) are NaN.
+    '''
+    return np.dtype([('first_scan', '<i8'),
+                     ('host_time', '<f8'),
+                     ('n_scans', '<i8'),
+                     ('data', np.dtype(sample_dtype).newbyteorder('<'), (n_channels, block_scans))])
+
+class DaqBlockWriter():
+    '''
+    Writes DAQ samples as fixed-size binary blocks after a JSON header padded to DAQ_DATA_HEADER_SIZE bytes.
+    '''
+    def __init__(self, path, header, n_channels, block_scans, sample_dtype='float64'):
+        '''
+        header: dict of recording information (channels, scan rate, ...) stored in the JSON header
+        block_scans: scans per block; normally the scans per stream read
+        '''
+        self.path = path
+        self.n_channels = n_channels
+        self.block_scans = block_scans
+        self.block = np.zeros(1, dtype=daq_block_dtype(n_channels, block_scans, sample_dtype))
+        self.n_blocks = 0
+
+        self.file = open(path, 'wb')
+        self.header = {**header, 'format': 'binary', 'dtype': np.dtype(sample_dtype).name, 'n_channels': n_channels,
+                       'block_scans': block_scans, 'header_size': DAQ_DATA_HEADER_SIZE}
+        header_bytes = DAQ_DATA_MAGIC + json.dumps(self.header).encode() + b'\n'
+        assert len(header_bytes) <= DAQ_DATA_HEADER_SIZE, 'DAQ data header is too large.'
+        self.file.write(header_bytes.ljust(DAQ_DATA_HEADER_SIZE, b' '))
+
+    def write(self, data, first_scan, host_time):
+        '''
+        data: channel-major array of shape (n_channels, n_scans); split over several blocks if longer than block_scans
+        '''
+        for start in range(0, data.shape[1], self.block_scans):
+            chunk = data[:, start:start+self.block_scans]
+            n_scans = chunk.shape[1]
+            self.block['first_scan'] = first_scan + start
+            self.block['host_time'] = host_time
+            self.block['n_scans'] = n_scans
+            self.block['data'][0, :, :n_scans] = chunk
+            if n_scans < self.block_scans:
+                self.block['data'][0, :, n_scans:] = np.nan
+            self.file.write(self.block.tobytes())
+            self.n_blocks += 1
+
+    def close(self, stream_metrics=None):
+        '''
+        stream_metrics: summary (see StreamMetrics.summary) added to the header, if it still fits in DAQ_DATA_HEADER_SIZE
+        '''
+        if stream_metrics is not None:
+            header_bytes = DAQ_DATA_MAGIC + json.dumps({**self.header, 'stream_metrics': stream_metrics}).encode() + b'\n'
+            if len(header_bytes) <= DAQ_DATA_HEADER_SIZE:
+                self.file.seek(0)
+                self.file.write(header_bytes.ljust(DAQ_DATA_HEADER_SIZE, b' '))
+            else:
+                print(f'{self.path}: stream metrics do not fit in the header; not written.')
+        self.file.close()
+
+class TxtDaqWriter():
+    '''
+    Writes the original text format: a JSON header line, then one line of samples per scan,
+    and optionally a footer line '# {stream metrics JSON}' (skipped by np.loadtxt as a comment).
+    '''
+    def __init__(self, path, header):
+        self.path = path
+        self.file = open(path, 'a')
+        self.file.write(json.dumps(header) + "\n")
+        self.file.flush()
+
+    def write(self, data, first_scan, host_time):
+        np.savetxt(self.file, data.T, fmt='%.18e', newline='\n')
+
+    def close(self, stream_metrics=None):
+        if stream_metrics is not None:
+            self.file.write('# ' + json.dumps({'stream_metrics': stream_metrics}) + '\n')
+        self.file.close()
+
+def open_daq_writer(path, header, n_channels, block_scans, record_format='float64'):
+    assert record_format in DAQ_RECORD_FORMATS, f'record_format should be one of {DAQ_RECORD_FORMATS}'
+    if record_format == 'txt':
+        return TxtDaqWriter(path, header)
+    return DaqBlockWriter(path, header, n_channels, block_scans, sample_dtype=record_format)
+
+def read_daq_header(path):
+    '''
+    Returns the JSON header of a binary or text DAQ recording. Binary headers have 'format': 'binary'.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(DAQ_DATA_MAGIC)) == DAQ_DATA_MAGIC:
+            return json.loads(f.read(DAQ_DATA_HEADER_SIZE - len(DAQ_DATA_MAGIC)).decode().strip())
+        f.seek(0)
+        return json.loads(f.readline().decode())
+
+def load_daq_blocks(path):
+    '''
+    Returns (header, blocks): blocks is a read-only memmap of the binary file's blocks (see daq_block_dtype).
+    The block count is inferred from the file size, so files from an interrupted recording can still be read.
+    '''
+    header = read_daq_header(path)
+    assert header.get('format') == 'binary', f'{path} is not a binary DAQ recording; use load_daq_data.'
+    dtype = daq_block_dtype(header['n_channels'], header['block_scans'], header['dtype'])
+    n_blocks = (os.path.getsize(path) - header['header_size']) // dtype.itemsize
+    if n_blocks == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode='r', offset=header['header_size'], shape=(n_blocks,))
+
+def load_daq_data(path):
+    '''
+    Reads a DAQ recording in either format.
+    Returns (header, data, blocks): data is channel-major, of shape (n_channels, n_scans);
+    blocks has first_scan, host_time and n_scans per block (None for text recordings).
+    Scans missing from a binary recording (blocks dropped from a full write queue) are NaN in data, so that
+    data stays aligned with the scan numbers; header['gaps'] lists them as [first missing scan, number of scans].
+    '''
+    header = read_daq_header(path)
+    if header.get('format') != 'binary':
+        with open(path, 'r') as f:
+            f.readline()
+            data = np.loadtxt(f, ndmin=2).T
+        with open(path, 'rb') as f:
+            f.seek(max(os.path.getsize(path) - 65536, 0))
+            footer = [line for line in f.read().decode().splitlines() if line.startswith('# {')]
+        if len(footer) > 0:
+            header.update(json.loads(footer[-1][2:]))
+        return header, data, None
+
+    header, blocks = load_daq_blocks(path)
+    block_info = np.zeros(len(blocks), dtype=[('first_scan', '<i8'), ('host_time', '<f8'), ('n_scans', '<i8')])
+    for k in block_info.dtype.names:
+        block_info[k] = blocks[k]
+    ends = block_info['first_scan'] + block_info['n_scans']
+    gap_idx = np.flatnonzero(block_info['first_scan'][1:] > ends[:-1])
+    header['gaps'] = [[int(ends[i]), int(block_info['first_scan'][i+1] - ends[i])] for i in gap_idx]
+    if len(header['gaps']) > 0:
+        print(f"{path}: {sum(n for _, n in header['gaps'])} scans missing in {len(header['gaps'])} gaps; filled with NaN.")
+        first = block_info['first_scan'][0]
+        data = np.full((header['n_channels'], int(ends[-1] - first)), np.nan)
+        for block in blocks:
+            start = int(block['first_scan'] - first)
+            data[:, start:start+block['n_scans']] = block['data'][:, :block['n_scans']]
+    elif len(blocks) > 0 and np.all(blocks['n_scans'][:-1] == header['block_scans']):
+        # Only the last block can be short: drop its padding after joining the blocks
+        data = blocks['data'].transpose(1, 0, 2).reshape(header['n_channels'], -1)[:, :int(blocks['n_scans'].sum())]
+    else:
+        data = np.concatenate([block['data'][:, :block['n_scans']] for block in blocks], axis=1) if len(blocks) > 0 else np.zeros((header['n_channels'], 0))
+    return header, data, block_info
@@ -1,12 +1,15 @@
 import numpy as np
 import time
-import matplotlib.pyplot as plt
 from datetime import datetime
 import sys
+import queue, threading
 from labjack import ljm
-from collections import deque
 import socket, atexit
-import json
+
+from jackfish.devices.segment_manifest import SegmentManifest, segment_path, manifest_path
+from jackfish.devices.daqs.daq_data import open_daq_writer, DAQ_RECORD_FORMATS
+from jackfish.devices.daqs.stream_metrics import StreamMetrics
+from jackfish.devices.daqs.stream_blocks import block_from_read, count_skipped_scans, SampleRing
 
 #%%
 class LabJack():
@@ -14,16 +17,27 @@ class LabJack():
     Initializes and controls input for Labjack T4/T7.
     '''
     
-    def __init__(self, serial_number=None, name=None):
+    def __init__(self, serial_number=None, name=None, device_type="TSERIES", connection_type="ANY", identifier=None):
+        '''
+        device_type, connection_type, identifier: passed to ljm.openS; identifier defaults to serial_number
+        (see DeviceDiscovery.labjack_open_args for opening a device over the connection it was found on)
+        '''
         self.name = name
         
         # Store initialization arguments
-        self.preview_queue = []
+        self.preview_queue = SampleRing(0, 0)
         self.collect_preview_queue = False
         self.streaming = False
+        self.callback_lock = threading.Lock()
+        self.writer_thread = None
+        self.fanout_thread = None
+        self.metrics = StreamMetrics()
+        self.stream_error = None
         
         # Initialize ljm T4/T7 handle
-        self.handle = ljm.openS("TSERIES", "ANY", "ANY" if serial_number is None else serial_number)
+        if identifier is None:
+            identifier = "ANY" if serial_number is None else serial_number
+        self.handle = ljm.openS(device_type, connection_type, identifier)
         self.info = ljm.getHandleInfo(self.handle)
         self.deviceType = self.info[0]
         self.serial_number = self.info[2]
@@ -73,29 +87,67 @@ class LabJack():
             "Serial number: %i, IP address: %s, Port: %i,\nMax bytes per MB: %i" %
             (self.info[0], self.info[1], self.info[2], ljm.numberToIP(self.info[3]), self.info[4], self.info[5]))
 
-    def start_stream(self, do_record=True, record_filepath="", input_channels={"AIN0": "Input 0", "AIN1": "Input 1"}, scanRate=3000, scansPerRead=1000, preview_queue_len_sec=10, socket_target=None):
+    def start_stream(self, do_record=True, record_filepath="", input_channels={"AIN0": "Input 0", "AIN1": "Input 1"}, scanRate=3000, scansPerRead=1000, preview_queue_len_sec=10, socket_target=None, segment_scans=None, segment_sec=None, record_format='float64', write_queue_sec=10, skip_budget=None, max_backlog_sec=1):
+        '''
+        segment_scans, segment_sec: if either is given, the recording is rotated into a new file (with its own header) 
+            once the current one holds that many scans or seconds. Rotation happens between reads, so segments hold whole reads.
+        record_format: one of DAQ_RECORD_FORMATS; 'float64' / 'float32' write one binary block per read (see daq_data.py), 'txt' writes text lines
+        write_queue_sec: seconds of data the queue between the reader and the writer holds before blocks are dropped
+        skip_budget: scans that may be skipped (by the device or dropped from a full write queue) before stream_error is set; None for no limit
+        max_backlog_sec: device + LJM backlog above which a read is counted in backlog_over_limit and stream_error is set; None for no limit
+        '''
+        self.prepare_stream(do_record=do_record, record_filepath=record_filepath, input_channels=input_channels, scanRate=scanRate, scansPerRead=scansPerRead, 
+                            preview_queue_len_sec=preview_queue_len_sec, socket_target=socket_target, segment_scans=segment_scans, segment_sec=segment_sec, 
+                            record_format=record_format, write_queue_sec=write_queue_sec, skip_budget=skip_budget, max_backlog_sec=max_backlog_sec)
+        self.begin_stream()
+
+    def prepare_stream(self, do_record=True, record_filepath="", input_channels={"AIN0": "Input 0", "AIN1": "Input 1"}, scanRate=3000, scansPerRead=1000, preview_queue_len_sec=10, socket_target=None, segment_scans=None, segment_sec=None, record_format='float64', write_queue_sec=10, skip_budget=None, max_backlog_sec=1):
+        '''
+        Sets up everything for start_stream (channels, record file, socket) except starting the stream itself, 
+            so that the stream can be started by begin_stream at the same moment as other devices.
+        '''
+        # The writer of a stream that did not drain in time still uses the record file and manifest set up here
+        if self.stream_threads_alive():
+            raise RuntimeError(f"DAQ {self.serial_number}: the previous stream is still writing; try again once it has finished.")
+
         self.input_channels = input_channels
         if isinstance(self.input_channels, list):
              self.input_channels = {chan:chan for chan in self.input_channels}
         self.n_input_channels = len(self.input_channels)
 
+        self.requested_scan_rate = scanRate
+        self.scansPerRead = scansPerRead
         if self.n_input_channels == 0:
             return
 
         self.aScanList = ljm.namesToAddresses(self.n_input_channels, list(self.input_channels.keys()))[0]
 
-        preview_queue_len = int(preview_queue_len_sec * scanRate * self.n_input_channels)
-        self.preview_queue = deque([0]*preview_queue_len, maxlen=preview_queue_len) #only for visualization; not for storing whole data
+        self.write_queue_len = max(int(np.ceil(write_queue_sec * scanRate / scansPerRead)), 2)
+        self.fanout_queue_len = 4
+        self.skip_budget = skip_budget
+        self.max_backlog_sec = max_backlog_sec
+        self.max_backlog_scans = max_backlog_sec * scanRate if max_backlog_sec is not None else None
+        self.drain_timeout = 5 # s
+        self.max_datagram_bytes = 65000
 
+        self.preview_queue = SampleRing(self.n_input_channels, int(preview_queue_len_sec * scanRate)) #only for visualization; not for storing whole data
+
+        assert record_format in DAQ_RECORD_FORMATS, f'record_format should be one of {DAQ_RECORD_FORMATS}'
         self.do_record = do_record
         self.record_filepath = record_filepath
+        self.record_format = record_format
+        self.segment_scans = segment_scans
+        self.segment_sec = segment_sec
+        self.segmented = segment_scans is not None or segment_sec is not None
+        self.record_outfile = None
         if self.do_record:
-            self.record_outfile = open(self.record_filepath, "a")
-
-            header = {'input_channels':self.input_channels, 'scan_rate':scanRate}
-
-            self.record_outfile.write(json.dumps(header) + "\n")
-            self.record_outfile.flush()
+            self.segment_index = 0
+            if self.segmented:
+                self.manifest = SegmentManifest(manifest_path(self.record_filepath), 
+                                                {'serial_number': self.serial_number, 'input_channels': self.input_channels, 'scan_rate': scanRate,
+                                                 'segment_scans': segment_scans, 'segment_sec': segment_sec, 'record_format': record_format})
+            else:
+                self.open_record_file(self.record_filepath, scanRate)
 
 
         #### Socket stream ####
@@ -127,109 +179,288 @@ class LabJack():
             # self.socket_outfile = self.client_socket.makefile('wb')
         ####
 
+    def begin_stream(self):
+        '''
+        Starts the stream prepared by prepare_stream. On failure, undoes the partial start and re-raises,
+        so that a start of several devices together can report the error and undo the others.
+        '''
+        if self.n_input_channels == 0:
+            return
+
         try:
+            self.scanRate = self.requested_scan_rate
+            self.reset_stream_counters()
+            self.start_stream_threads()
+
             # Configure and start stream
-            scanRate = ljm.eStreamStart(self.handle, scansPerRead, self.n_input_channels, self.aScanList, scanRate)
+            scanRate = ljm.eStreamStart(self.handle, self.scansPerRead, self.n_input_channels, self.aScanList, self.requested_scan_rate)
             print("\nLabjack stream started with a scan rate of %0.0f Hz." % scanRate)
             self.scanRate = scanRate
-            self.scansPerRead = scansPerRead
+            self.stream_start_time = datetime.now()
+            self.metrics.scan_rate = scanRate
+            self.metrics.start_time = time.time()
 
             self.streaming = True #flag for recording status
+            # LJM calls stream_callback on its own thread every time scansPerRead scans are ready
             ljm.setStreamCallback(self.handle, self.stream_callback)
 
         except ljm.LJMError:
             ljme = sys.exc_info()[1]
             print(ljme)
+            self.abort_stream()
+            raise
         except Exception:
             e = sys.exc_info()[1]
             print(e)
+            self.abort_stream()
+            raise
 
-    def stop_stream(self):
-        # self.stream_start_time = datetime.now() # maybe not the best
+    def abort_stream(self):
+        # Undoes a partial begin_stream, or a prepare_stream that was not followed by begin_stream
         if self.streaming:
-            try:
-                print("\nLabjack stream stopping")
-                self.streaming = False
-                ljm.eStreamStop(self.handle)
-                self.stream_end_time = datetime.now()
-                
-                recording_duration = self.stream_end_time - self.stream_start_time
-                tt = recording_duration.seconds + float(recording_duration.microseconds) / 1000000
-                print("Time taken = %f seconds" % (tt))
-                print("LJM Scan Rate = %f scans/second" % (self.scanRate))
-                print("Timed Scan Rate = %f scans/second" % (self.totScans / tt))
-                print("Timed Sample Rate = %f samples/second" % (self.totScans * self.n_input_channels / tt))
-                print("Skipped scans = %0.0f" % (self.totSkip / self.n_input_channels))
+            self.stop_stream()
+        elif self.writer_thread is not None:
+            self.stop_stream_threads()
+        elif getattr(self, 'record_outfile', None) is not None:
+            self.record_outfile.close()
+            self.record_outfile = None
 
-            except ljm.LJMError:
-                ljme = sys.exc_info()[1]
-                print(ljme)
-            except Exception:
-                e = sys.exc_info()[1]
-                print(e)
-        
-    def stream_callback(self, arg):
+    def reset_stream_counters(self):
         self.totScans = 0
-        self.totSkip = 0  # Total skipped samples
-
-        self.stream_start_time = datetime.now()
-        t = time.time()
-        while self.streaming:
-            try:
-                ret = ljm.eStreamRead(self.handle)
-                data = ret[0]
-
-
-                scans = len(data) / self.n_input_channels
-                self.totScans += scans
-
-                print(time.time()-t)
-                t = time.time()
-
-                # Count the skipped samples which are indicated by -9999 values. Missed
-                # samples occur after a device's stream buffer overflows and are
-                # reported after auto-recover mode ends.
-                curSkip = data.count(-9999.0)
-                self.totSkip += curSkip
-                
-                print("  Scans Skipped = %0.0f, Scan Backlogs: Device = %i, LJM = "
-                    "%i" % (curSkip/self.n_input_channels, ret[1], ret[2]))
-
+        self.metrics = StreamMetrics(self.scanRate, self.scansPerRead, self.n_input_channels)
+        self.stream_error = None
+
+    def start_stream_threads(self):
+        '''
+        The reader (stream_callback, one call per LJM callback) only calls eStreamRead and puts each block on two bounded queues:
+        the write queue, drained by the writer thread (record file, skip counting), and the fan-out queue,
+        drained by the fan-out thread (socket, preview). A full write queue loses the block, which counts
+        against the skip budget; a full fan-out queue only skips the block for the socket and preview.
+        Both threads end once stop_event is set: the writer after emptying the write queue, the fan-out thread right away.
+        '''
+        self.write_queue = queue.Queue(maxsize=self.write_queue_len)
+        self.fanout_queue = queue.Queue(maxsize=self.fanout_queue_len)
+        self.stop_event = threading.Event()
+        write_queue, fanout_queue, stop_event = self.write_queue, self.fanout_queue, self.stop_event
+
+        def writer():
+            while True:
+                try:
+                    block = write_queue.get(timeout=0.1)
+                except queue.Empty:
+                    block = None
+                if block is None: # timeout, or the wake-up marker from stop_stream_threads (always last)
+                    if stop_event.is_set():
+                        break
+                    continue
+                first_scan, read_time, data, device_backlog, ljm_backlog = block
+                try:
+                    if self.do_record and self.segmented and (self.record_outfile is None or self.segment_full(first_scan)):
+                        self.rotate_record_file(first_scan)
+
+                    # Count the skipped samples which are indicated by -9999 values. Missed
+                    # samples occur after a device's stream buffer overflows and are
+                    # reported after auto-recover mode ends.
+                    curSkip = count_skipped_scans(data)
+                    if curSkip > 0:
+                        self.metrics.on_skip(curSkip)
+                        self.check_skip_budget()
+
+                    if self.do_record:
+                        self.record_outfile.write(data, first_scan, read_time)
+                except Exception as e:
+                    print(e)
+                self.written_scans = first_scan + data.shape[1]
+
+            if self.do_record and self.record_outfile is not None:
+                self.record_outfile.close(stream_metrics=self.metrics.summary())
+                if self.segmented:
+                    self.manifest.info['stream_metrics'] = self.metrics.summary()
+                    self.manifest.close_segment(int(self.written_scans) - 1, time.time())
+                self.record_outfile = None
+
+        def fanout():
+            while not stop_event.is_set():
+                try:
+                    block = fanout_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if block is None:
+                    break
+                first_scan, read_time, data, device_backlog, ljm_backlog = block
                 if self.socket_target is not None:
                     try:
-                        data_to_send = data # should be changed as appropriate for use
-                        data_to_send = bytes(data_to_send,'utf-8')
-                        self.client_socket.sendto(data_to_send,('127.0.0.1',self.port))
-                        # self.socket_outfile.write(bytes(str(data_to_send) + "\n"),'utf-8')
-                        # self.socket_outfile.flush()
-                    except BrokenPipeError:
+                        # Raw float64 samples, scan-interleaved as read from LJM, in datagrams of whole scans
+                        data_to_send = data.T.tobytes()
+                        datagram_len = (self.max_datagram_bytes // (8 * self.n_input_channels)) * 8 * self.n_input_channels
+                        for i in range(0, len(data_to_send), datagram_len):
+                            self.client_socket.sendto(data_to_send[i:i+datagram_len],('127.0.0.1',self.port))
+                    except (BrokenPipeError, OSError):
                         # will happen if the other side disconnected
                         pass
 
-                if self.do_record:
-                    # print('Writing')
-                    data_2d = np.asarray(data).reshape((-1, self.n_input_channels))
-                    np.savetxt(self.record_outfile, data_2d, fmt='%.18e', newline='\n')
-                    # self.record_outfile.write(str(data)[1:-1] + "\n") # [1:-1] removes square brackets
-                    # self.record_outfile.flush()
-                
                 if self.collect_preview_queue:
-                    self.preview_queue.extend(data)
-                 
+                    self.preview_queue.write(data)
+
+            if self.socket_target is not None:
+                self.client_socket.close()
+
+        self.written_scans = 0
+        self.writer_thread = threading.Thread(target=writer, daemon=True)
+        self.fanout_thread = threading.Thread(target=fanout, daemon=True)
+        self.writer_thread.start()
+        self.fanout_thread.start()
+
+    def stop_stream_threads(self):
+        '''
+        Signals the writer and fan-out threads to end and waits up to drain_timeout for the writer
+        to write what is queued and close the record file. Returns True if it finished.
+        A writer that did not finish keeps running; prepare_stream refuses a new stream until it has.
+        '''
+        if self.writer_thread is None:
+            return True
+        self.stop_event.set()
+        # Wakes the threads up without waiting for their poll; a full queue gets noticed at the next poll instead
+        for stream_queue in (self.write_queue, self.fanout_queue):
+            try:
+                stream_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        self.writer_thread.join(timeout=self.drain_timeout)
+        self.fanout_thread.join(timeout=1)
+        drained = not self.writer_thread.is_alive()
+        if not drained:
+            print(f"Writer did not finish within {self.drain_timeout} s ({self.write_queue.qsize()} blocks left).")
+            return False
+        self.writer_thread = None
+        self.fanout_thread = None
+        return True
+
+    def stream_threads_alive(self):
+        return any(thread is not None and thread.is_alive() for thread in (self.writer_thread, self.fanout_thread))
+
+    def check_skip_budget(self):
+        skipped_scans = self.metrics.skipped_scans + self.metrics.dropped_scans
+        if self.skip_budget is not None and skipped_scans > self.skip_budget and self.stream_error is None:
+            self.stream_error = f"{skipped_scans:.0f} scans skipped, more than the budget of {self.skip_budget}."
+            print(f"DAQ {self.serial_number}: {self.stream_error}")
+
+    def check_backlog(self, backlog):
+        if self.stream_error is None:
+            self.stream_error = f"Backlog of {backlog:.0f} scans, more than the limit of {self.max_backlog_sec} s ({self.max_backlog_scans:.0f} scans)."
+            print(f"DAQ {self.serial_number}: {self.stream_error}")
+
+    def get_stream_stats(self):
+        '''
+        Returns the metrics summary of the current (or last) stream, with the current queue depth and error.
+        '''
+        return {**self.metrics.summary(),
+                'queue_depth': self.write_queue.qsize() if hasattr(self, 'write_queue') else 0,
+                'error': self.stream_error}
+
+    def open_record_file(self, filepath, scanRate, first_scan=0):
+        header = {'input_channels':self.input_channels, 'scan_rate':scanRate}
+        if self.segmented:
+            header['segment_index'] = self.segment_index
+            header['first_scan'] = first_scan
+
+        self.record_outfile = open_daq_writer(filepath, header, self.n_input_channels, self.scansPerRead, self.record_format)
+
+    def rotate_record_file(self, first_scan):
+        '''
+        Closes the current segment (if any) and opens the next one, starting at scan first_scan.
+        '''
+        now = time.time()
+        if self.record_outfile is not None:
+            self.record_outfile.close(stream_metrics=self.metrics.summary())
+            self.manifest.close_segment(int(first_scan) - 1, now)
+            self.segment_index += 1
+        filepath = segment_path(self.record_filepath, self.segment_index)
+        self.open_record_file(filepath, self.scanRate, first_scan=int(first_scan))
+        self.manifest.open_segment({'data': filepath}, int(first_scan), now)
+        self.segment_start_scan = first_scan
+        self.segment_start_time = now
+
+    def segment_full(self, first_scan):
+        if self.segment_scans is not None and first_scan - self.segment_start_scan >= self.segment_scans:
+            return True
+        if self.segment_sec is not None and time.time() - self.segment_start_time >= self.segment_sec:
+            return True
+        return False
+
+    def stop_stream(self):
+        '''
+        Stops the stream, then drains: once no callback is running and LJM has stopped, the writer
+        writes what is still queued (for at most drain_timeout s). The time taken is metrics.teardown_sec.
+        '''
+        if self.streaming:
+            print("\nLabjack stream stopping")
+            t_stop = time.perf_counter()
+            try:
+                # Waits for a callback in progress; callbacks after this return without reading
+                with self.callback_lock:
+                    self.streaming = False
+                ljm.eStreamStop(self.handle)
+                self.stream_end_time = datetime.now()
             except ljm.LJMError:
                 ljme = sys.exc_info()[1]
                 print(ljme)
             except Exception:
                 e = sys.exc_info()[1]
                 print(e)
-        else:
+            self.stop_stream_threads()
+            self.metrics.teardown_sec = time.perf_counter() - t_stop
             print("Shutting off Stream Callback")
-            if self.socket_target is not None:
-                self.client_socket.close()
-                # self.socket_outfile.close()
-            if self.do_record:
-                self.record_outfile.close()
+
+            stats = self.metrics.summary()
+            print(f"LJM scan rate = {self.scanRate:.0f} scans/s, achieved = {stats['achieved_scan_rate']:.1f} scans/s over {stats['duration']:.1f} s; "
+                  f"skipped scans = {stats['skipped_scans']}, dropped scans = {stats['dropped_scans']}, "
+                  f"max backlog: device = {stats['device_backlog']['max']}, LJM = {stats['ljm_backlog']['max']}, "
+                  f"max queue depth = {stats['max_queue_depth']}/{self.write_queue_len}, "
+                  f"callback max = {stats['callback_ms']['max']:.2f} ms, teardown = {stats['teardown_sec']*1000:.0f} ms")
+        
+    def stream_callback(self, handle):
+        '''
+        Called by LJM each time scansPerRead scans are ready. Does exactly one eStreamRead and hands the block
+        to the writer and fan-out queues without waiting on them, so it returns well within one read period.
+        '''
+        t_enter = time.perf_counter()
+        with self.callback_lock:
+            if not self.streaming:
+                return
+            try:
+                ret = ljm.eStreamRead(self.handle)
+                read_time = time.time()
+                # Converted once; the writer, preview and socket all use this array
+                data = block_from_read(ret[0], self.n_input_channels)
+                n_scans = data.shape[1]
+                block = (int(self.totScans), read_time, data, ret[1], ret[2])
+                self.totScans += n_scans
+
+                self.metrics.on_read(read_time, n_scans, ret[1], ret[2])
+                if self.max_backlog_scans is not None and ret[1] + ret[2] > self.max_backlog_scans:
+                    self.metrics.n_backlog_over_limit += 1
+                    self.check_backlog(ret[1] + ret[2])
+
+                try:
+                    self.write_queue.put_nowait(block)
+                except queue.Full:
+                    self.metrics.on_drop(n_scans)
+                    self.check_skip_budget()
+                self.metrics.on_queue_depth(self.write_queue.qsize())
+                try:
+                    self.fanout_queue.put_nowait(block)
+                except queue.Full:
+                    self.metrics.n_fanout_dropped += 1
+
+            except Exception as e: # ljm.LJMError or a conversion error; must not propagate into LJM's thread
+                self.metrics.on_read_error(e)
+                if self.metrics.n_read_errors == 1:
+                    print(f"DAQ {self.serial_number}: stream read error: {e}")
+                return
+        self.metrics.on_callback((time.perf_counter() - t_enter) * 1000)
     
+
     def start_collect_preview_queue(self):
         self.collect_preview_queue = True
     def stop_collect_preview_queue(self):
@@ -242,6 +473,7 @@ class LabJack():
         ljm.close(self.handle)
         
     def plot_stream(self, data, numAddresses, scanRate):
+        import matplotlib.pyplot as plt
         data_np = np.asarray(data).reshape((-1,numAddresses)).T
 
         x = np.arange(data_np.shape[1])/scanRate*1000
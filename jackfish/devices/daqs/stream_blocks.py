@@ -0,0 +1,58 @@
+import numpy as np
+
+# Value LJM puts in place of samples that were skipped after a device buffer overflow
+SKIP_VALUE = -9999.0
+
+def block_from_read(data, n_channels):
+    '''
+    Converts one eStreamRead buffer (list of scan-interleaved samples) to a channel-major array of shape (n_channels, n_scans).
+    The list is converted once; the result is a transposed view of that array, so block.T is the scan-interleaved layout
+    again without a copy (e.g. for block.T.tobytes()).
+    '''
+    samples = np.fromiter(data, dtype=np.float64, count=len(data))
+    return samples.reshape(-1, n_channels).T
+
+def count_skipped_scans(block):
+    '''
+    Skipped samples in a channel-major block, in scans (as LJM reports skips for whole scans).
+    '''
+    return np.count_nonzero(block == SKIP_VALUE) / block.shape[0]
+
+class SampleRing():
+    '''
+    Keeps the last n_scans scans of every channel for the preview.
+
+    write() copies a channel-major block in with at most two slice assignments; latest() returns an ordered copy
+    of one channel. The reader may see a partly written block, which is fine for display.
+    '''
+    def __init__(self, n_channels, n_scans):
+        self.buffer = np.zeros((n_channels, n_scans))
+        self.pos = 0 # column the next scan is written to
+        self.n_written = 0
+
+    def write(self, block):
+        size = self.buffer.shape[1]
+        n = block.shape[1]
+        if size == 0:
+            return
+        if n >= size:
+            self.buffer[:] = block[:, n-size:]
+            self.pos = 0
+        elif self.pos + n <= size:
+            self.buffer[:, self.pos:self.pos+n] = block
+            self.pos = (self.pos + n) % size
+        else:
+            k = size - self.pos
+            self.buffer[:, self.pos:] = block[:, :k]
+            self.buffer[:, :n-k] = block[:, k:]
+            self.pos = n - k
+        self.n_written += n
+
+    def latest(self, channel, n_scans):
+        '''
+        Returns the last n_scans (or fewer, if not yet written) samples of channel, oldest first.
+        '''
+        n = min(n_scans, self.buffer.shape[1], self.n_written)
+        if channel >= self.buffer.shape[0] or n <= 0:
+            return np.zeros(0)
+        return self.buffer[channel].take(np.arange(self.pos - n, self.pos), mode='wrap')
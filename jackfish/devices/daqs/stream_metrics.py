@@ -0,0 +1,115 @@
+import time
+import bisect
+
+import numpy as np
+
+# Histogram bin edges; each histogram has one more bin than edges, for values at or above the last edge
+READ_INTERVAL_EDGES_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+BACKLOG_EDGES_SCANS = [1, 10, 100, 1000, 10000, 100000]
+CALLBACK_EDGES_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100]
+
+class StreamMetrics():
+    '''
+    Counters and histograms of one LabJack stream: achieved scan rate, interval between reads,
+    device and LJM scan backlogs, skipped scans, time spent in each stream callback and teardown time.
+
+    The reader calls on_read once per eStreamRead and the writer calls on_skip; both only do a few
+    integer updates. summary() returns a JSON-serializable dict for the UI and the recording file.
+    '''
+    def __init__(self, scan_rate=None, scans_per_read=None, n_channels=None):
+        self.scan_rate = scan_rate
+        self.scans_per_read = scans_per_read
+        self.n_channels = n_channels
+
+        self.start_time = time.time()
+        self.last_read_time = None
+        self.n_reads = 0
+        self.scans = 0
+        self.skipped_scans = 0 # reported by the device as -9999 samples
+        self.dropped_scans = 0 # lost because the write queue was full
+        self.n_fanout_dropped = 0
+        self.max_queue_depth = 0
+        self.n_backlog_over_limit = 0
+
+        self.read_interval_counts = [0] * (len(READ_INTERVAL_EDGES_MS) + 1)
+        self.read_interval_max = 0.0
+        self.device_backlog_counts = [0] * (len(BACKLOG_EDGES_SCANS) + 1)
+        self.device_backlog_max = 0
+        self.ljm_backlog_counts = [0] * (len(BACKLOG_EDGES_SCANS) + 1)
+        self.ljm_backlog_max = 0
+        self.callback_counts = [0] * (len(CALLBACK_EDGES_MS) + 1)
+        self.callback_max = 0.0
+        self.callback_sum = 0.0
+        self.n_callbacks = 0
+        self.n_read_errors = 0
+        self.last_read_error = None
+        self.teardown_sec = None
+
+    def on_read(self, read_time, n_scans, device_backlog, ljm_backlog):
+        if self.last_read_time is not None:
+            interval_ms = (read_time - self.last_read_time) * 1000
+            self.read_interval_counts[bisect.bisect_right(READ_INTERVAL_EDGES_MS, interval_ms)] += 1
+            self.read_interval_max = max(self.read_interval_max, interval_ms)
+        self.last_read_time = read_time
+        self.n_reads += 1
+        self.scans += n_scans
+
+        self.device_backlog_counts[bisect.bisect_right(BACKLOG_EDGES_SCANS, device_backlog)] += 1
+        self.device_backlog_max = max(self.device_backlog_max, device_backlog)
+        self.ljm_backlog_counts[bisect.bisect_right(BACKLOG_EDGES_SCANS, ljm_backlog)] += 1
+        self.ljm_backlog_max = max(self.ljm_backlog_max, ljm_backlog)
+
+    def on_callback(self, callback_ms):
+        self.callback_counts[bisect.bisect_right(CALLBACK_EDGES_MS, callback_ms)] += 1
+        self.callback_max = max(self.callback_max, callback_ms)
+        self.callback_sum += callback_ms
+        self.n_callbacks += 1
+
+    def on_read_error(self, error):
+        self.n_read_errors += 1
+        self.last_read_error = str(error)
+
+    def on_skip(self, skipped_scans):
+        self.skipped_scans += skipped_scans
+
+    def on_drop(self, dropped_scans):
+        self.dropped_scans += dropped_scans
+
+    def on_queue_depth(self, depth):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def achieved_scan_rate(self):
+        if self.last_read_time is None or self.last_read_time <= self.start_time:
+            return 0.0
+        return self.scans / (self.last_read_time - self.start_time)
+
+    def summary(self):
+        return {'scan_rate': self.scan_rate,
+                'achieved_scan_rate': self.achieved_scan_rate(),
+                'duration': (self.last_read_time or self.start_time) - self.start_time,
+                'reads': self.n_reads,
+                'scans': int(self.scans),
+                'skipped_scans': int(self.skipped_scans),
+                'dropped_scans': int(self.dropped_scans),
+                'fanout_dropped_blocks': self.n_fanout_dropped,
+                'max_queue_depth': self.max_queue_depth,
+                'backlog_over_limit': self.n_backlog_over_limit,
+                'read_interval_ms': {'edges': READ_INTERVAL_EDGES_MS, 'counts': list(self.read_interval_counts), 'max': self.read_interval_max},
+                'device_backlog': {'edges': BACKLOG_EDGES_SCANS, 'counts': list(self.device_backlog_counts), 'max': int(self.device_backlog_max)},
+                'ljm_backlog': {'edges': BACKLOG_EDGES_SCANS, 'counts': list(self.ljm_backlog_counts), 'max': int(self.ljm_backlog_max)},
+                'callback_ms': {'edges': CALLBACK_EDGES_MS, 'counts': list(self.callback_counts), 'max': self.callback_max,
+                                'mean': self.callback_sum / self.n_callbacks if self.n_callbacks > 0 else 0.0},
+                'read_errors': self.n_read_errors,
+                'last_read_error': self.last_read_error,
+                'teardown_sec': self.teardown_sec}
+
+def histogram_percentile(hist, pct):
+    '''
+    Upper edge of the bin that contains the pct-th percentile of a summary() histogram (inf for the last bin).
+    '''
+    counts = np.asarray(hist['counts'])
+    if counts.sum() == 0:
+        return 0
+    i = int(np.searchsorted(np.cumsum(counts), counts.sum() * pct / 100))
+    return hist['edges'][i] if i < len(hist['edges']) else np.inf
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+
+DISCOVERY_CACHE_PATH = os.path.expanduser('~/.config/jackfish/devices.json')
+
+# Held around Spinnaker system access (getting/releasing the system, listing and opening cameras),
+# so that discovery and camera initialization on other threads do not use it at the same time
+SPINNAKER_LOCK = threading.Lock()
+
+# ljm.constants values, spelled out so that the names can be passed back to ljm.openS
+LJM_DEVICE_TYPES = {4: 'T4', 7: 'T7', 8: 'T8'}
+LJM_CONNECTION_TYPES = {1: 'USB', 3: 'ETHERNET', 4: 'WIFI'}
+
+def list_flir_cameras():
+    '''
+    Returns {serial_number: {'index', 'model', 'interface'}} for the cameras Spinnaker can see, without initializing them.
+    '''
+    import PySpin
+    cameras = {}
+    with SPINNAKER_LOCK:
+        system = PySpin.System.GetInstance()
+        cam_list = system.GetCameras()
+        try:
+            for index in range(cam_list.GetSize()):
+                cam = cam_list.GetByIndex(index)
+                nodemap = cam.GetTLDeviceNodeMap()
+                info = {'index': index}
+                for key, node_name in (('serial_number', 'DeviceSerialNumber'), ('model', 'DeviceModelName'), ('interface', 'DeviceType')):
+                    node = nodemap.GetNode(node_name)
+                    info[key] = PySpin.CValuePtr(node).ToString() if PySpin.IsAvailable(node) and PySpin.IsReadable(node) else None
+                del cam
+                cameras[str(info.pop('serial_number') or index)] = info
+        finally:
+            cam_list.Clear()
+            system.ReleaseInstance()
+    return cameras
+
+def list_labjacks():
+    '''
+    Returns {serial_number: {'device_type', 'connection_type', 'ip_address'}} for the T-series LabJacks LJM can see.
+    A device reachable over several connections is listed once, preferring USB.
+    '''
+    from labjack import ljm
+    n_found, device_types, connection_types, serial_numbers, ip_addresses = ljm.listAll(ljm.constants.dtTSERIES, ljm.constants.ctANY)
+    daqs = {}
+    for i in range(n_found):
+        serial_number = str(serial_numbers[i])
+        if serial_number in daqs and daqs[serial_number]['connection_type'] == 'USB':
+            continue
+        daqs[serial_number] = {'device_type': LJM_DEVICE_TYPES.get(device_types[i], 'TSERIES'),
+                               'connection_type': LJM_CONNECTION_TYPES.get(connection_types[i], 'ANY'),
+                               'ip_address': ljm.numberToIP(ip_addresses[i]) if connection_types[i] != ljm.constants.ctUSB else None}
+    return daqs
+
+class DeviceDiscovery():
+    '''
+    Enumerates attached FLIR cameras and LabJacks on a background thread, without opening them.
+
+    Results are kept per kind as {serial_number (str): info dict} and saved to cache_path, so the devices seen
+    last time are known right away at the next startup: until this session's scan is done (or if it failed),
+    status() reports devices from the cache as 'cached' rather than 'present'.
+    '''
+    LISTERS = {'cameras': list_flir_cameras, 'daqs': list_labjacks}
+
+    def __init__(self, cache_path=DISCOVERY_CACHE_PATH):
+        self.cache_path = cache_path
+        self.devices = {kind: {} for kind in self.LISTERS}
+        self.errors = {}
+        self.scanned = {kind: False for kind in self.LISTERS}
+        self.scan_time = None
+        self.thread = None
+        self.load_cache()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.load(f)
+            for kind in self.LISTERS:
+                self.devices[kind] = cache.get(kind, {})
+        except (OSError, ValueError):
+            pass
+
+    def save_cache(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'w') as f:
+                json.dump({'time': time.time(), **self.devices}, f, indent=4)
+        except OSError:
+            pass
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.scanned = {kind: False for kind in self.LISTERS}
+
+        def scan():
+            t0 = time.perf_counter()
+            for kind, lister in self.LISTERS.items():
+                try:
+                    self.devices[kind] = lister()
+                    self.errors.pop(kind, None)
+                except Exception as e: # driver not installed, no permission, etc.
+                    self.errors[kind] = str(e)
+                    print(f'Discovery of {kind} failed: {e}')
+                self.scanned[kind] = True
+            self.scan_time = time.perf_counter() - t0
+            self.save_cache()
+
+        self.thread = threading.Thread(target=scan, daemon=True)
+        self.thread.start()
+
+    def is_done(self):
+        return all(self.scanned.values())
+
+    def status(self, kind, serial_number=None):
+        '''
+        kind: 'cameras' or 'daqs'
+        serial_number: str, or None for any device of this kind
+        Returns 'present' or 'missing' once this session's scan is done; before that (or if it failed),
+        'cached' if the device was found last time, else 'unknown'.
+        '''
+        if not self.scanned[kind] or kind in self.errors:
+            if serial_number is None:
+                return 'cached' if len(self.devices[kind]) > 0 else 'unknown'
+            return 'cached' if str(serial_number) in self.devices[kind] else 'unknown'
+        if serial_number is None:
+            return 'present' if len(self.devices[kind]) > 0 else 'missing'
+        return 'present' if str(serial_number) in self.devices[kind] else 'missing'
+
+    def get(self, kind, serial_number):
+        '''
+        Returns the info dict of a device found by the last scan (or the cache), or None.
+        '''
+        return self.devices[kind].get(str(serial_number))
+
+    def labjack_open_args(self, serial_number):
+        '''
+        Keyword arguments for LabJack() that open the device over the connection it was found on,
+        so LJM does not have to search every connection type again. Empty if the device is not known.
+        A device only known from the cache may have been moved to another connection or address since,
+        so only its device type is used.
+        '''
+        status = self.status('daqs', serial_number)
+        if status not in ('present', 'cached'):
+            return {}
+        info = self.get('daqs', serial_number)
+        if status == 'cached':
+            return {'device_type': info['device_type']}
+        open_args = {'device_type': info['device_type'], 'connection_type': info['connection_type']}
+        if info['ip_address'] is not None:
+            open_args['identifier'] = info['ip_address']
+        return open_args
@@ -0,0 +1,80 @@
+import os
+import json
+import threading
+
+class SegmentManifest():
+    '''
+    JSON manifest listing the segments of a rotated recording.
+
+    Each segment records its files, first/last frame (or scan) number and wall-clock time range.
+    The manifest is rewritten atomically whenever a segment is opened or closed, so downstream jobs
+    can poll it and start on segments marked 'complete' while recording continues.
+    A segment whose file is finished in the background stays incomplete until finish_segment; a segment whose
+    writer failed is never marked complete and gets the writer's 'returncode' instead.
+    '''
+    def __init__(self, path, info=None):
+        '''
+        info: dict of recording-level information stored alongside the segment list
+        '''
+        self.path = path
+        self.info = info if info is not None else {}
+        self.segments = []
+        self.lock = threading.Lock() # segments may be finished from other threads
+        self.write()
+
+    def open_segment(self, files, first, start_time):
+        '''
+        files: dict of {role: path}, e.g. {'video': ..., 'frame_info': ...}
+        first: first frame/scan number in the segment
+        start_time: host time (s since epoch) of the first frame/scan
+        '''
+        with self.lock:
+            self.segments.append({'index': len(self.segments),
+                                  'files': {k: os.path.basename(v) for k, v in files.items()},
+                                  'first': first,
+                                  'last': None,
+                                  'start_time': start_time,
+                                  'end_time': None,
+                                  'complete': False})
+            self.write()
+            return len(self.segments) - 1
+
+    def close_segment(self, last, end_time, returncode=None, pending=False):
+        '''
+        Closes the last segment. Returns its index.
+        returncode: of the segment's writer, if it has one (None or 0 means success)
+        pending: the file is still being finished in the background; call finish_segment when it is done
+        '''
+        with self.lock:
+            segment = self.segments[-1]
+            segment['last'] = last
+            segment['end_time'] = end_time
+            self.set_result(segment, None if pending else returncode, pending)
+            self.write()
+            return segment['index']
+
+    def finish_segment(self, index, returncode):
+        with self.lock:
+            self.set_result(self.segments[index], returncode, False)
+            self.write()
+
+    def set_result(self, segment, returncode, pending):
+        segment['complete'] = not pending and returncode in (None, 0)
+        if returncode not in (None, 0):
+            segment['returncode'] = returncode
+
+    def write(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({**self.info, 'segments': self.segments}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+def segment_path(path, segment_index):
+    '''
+    Inserts the segment index before the extension: cam_123.mp4 -> cam_123_seg000.mp4
+    '''
+    stem, ext = os.path.splitext(path)
+    return f'{stem}_seg{segment_index:03d}{ext}'
+
+def manifest_path(path):
+    return os.path.splitext(path)[0] + '_manifest.json'
@@ -0,0 +1,165 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+from jackfish.devices.cameras.ffmpeg_writer import FFmpegWriter, get_encoder_outputdict
+
+# libx264 presets from fastest to slowest (i.e. lowest to highest compression efficiency)
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium']
+
+class EncoderScheduler():
+    '''
+    Assigns an encoder, x264 preset and thread count to each camera so that every camera can be encoded in real time.
+
+    Encoder throughput is calibrated by piping synthetic frames through ffmpeg into a null muxer.
+    Calibrations are cached per (width, height, encoder, preset, threads), so repeated scheduling is cheap.
+    Calibration takes seconds per camera, so it is run in the background (calibrate_async) before recording;
+    assign(cams, cached_only=True) then never starts ffmpeg.
+    '''
+    def __init__(self, ffmpeg_location=None, n_nvidia_gpus=0, max_nvenc_sessions=2, n_cores=None, margin=1.25, calibration_sec=1.0):
+        '''
+        margin: required headroom, e.g. 1.25 means an encoder must run 25% faster than the camera framerate
+        calibration_sec: approximate duration of each calibration run
+        '''
+        self.ffmpeg_location = ffmpeg_location
+        self.n_nvidia_gpus = n_nvidia_gpus
+        self.max_nvenc_sessions = max_nvenc_sessions
+        self.n_cores = n_cores if n_cores is not None else os.cpu_count()
+        self.margin = margin
+        self.calibration_sec = calibration_sec
+
+        self.calibrations = {}
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    def calibrate(self, x, y, encoder='libx264', preset=None, threads=None, force=False):
+        '''
+        Returns the measured encode throughput in frames/s for frames of size (y, x).
+        '''
+        key = (x, y, encoder, preset, threads)
+        if key in self.calibrations and not force:
+            return self.calibrations[key]
+        if self.cancel_event.is_set():
+            return 0.0
+
+        # Smooth gradient plus moving noise: roughly as hard to encode as a dim, textured behavior video.
+        rng = np.random.default_rng(0)
+        base = np.add.outer(np.linspace(0, 119, y), np.linspace(0, 119, x)).astype(np.uint8)
+        frames = [base + rng.integers(0, 16, size=(y, x), dtype=np.uint8) for _ in range(8)]
+
+        outputdict = get_encoder_outputdict(encoder, preset, threads)
+        outputdict['-f'] = 'null'
+        writer = None
+        t0 = time.perf_counter()
+        n_frames = 0
+        try:
+            writer = FFmpegWriter('-', x, y, 30, outputdict=outputdict, ffmpeg_location=self.ffmpeg_location)
+            while time.perf_counter() - t0 < self.calibration_sec or n_frames < 2 * len(frames):
+                if self.cancel_event.is_set():
+                    break
+                writer.writeFrame(frames[n_frames % len(frames)])
+                n_frames += 1
+            returncode = writer.close()
+        except OSError: # ffmpeg missing, or encoder unavailable (broken pipe)
+            returncode = -1
+            if writer is not None:
+                writer.proc.kill()
+                writer.proc.wait()
+        elapsed = time.perf_counter() - t0
+        if self.cancel_event.is_set():
+            return 0.0 # not cached
+
+        fps = n_frames / elapsed if returncode == 0 else 0.0
+        print(f'Encoder calibration {x}x{y} {encoder} preset={preset} threads={threads}: {fps:.1f} fps')
+        self.calibrations[key] = fps
+        return fps
+
+    def calibrate_async(self, cams, force=False, on_done=None):
+        '''
+        Calibrates everything assign(cams) needs on a background thread. Does nothing if a calibration is already running.
+        on_done: function(assignments) called on that thread when it finishes (not if cancelled)
+        '''
+        if self.is_calibrating():
+            return
+        if force:
+            self.calibrations = {}
+        self.cancel_event.clear()
+
+        def calibrate_all():
+            assignments = self.assign(cams)
+            if on_done is not None and not self.cancel_event.is_set():
+                on_done(assignments)
+
+        self.thread = threading.Thread(target=calibrate_all, daemon=True)
+        self.thread.start()
+
+    def is_calibrating(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def cancel(self):
+        '''
+        Stops a running background calibration after the current ffmpeg run; partial results are not cached.
+        '''
+        self.cancel_event.set()
+
+    def assign(self, cams, cached_only=False):
+        '''
+        cams: dict of {key: (x, y, framerate)}
+        cached_only: use only calibrations already measured; returns None if any of them is missing
+        Returns a dict of {key: {'encoder', 'preset', 'threads', 'capacity_fps', 'required_fps', 'realtime'}}.
+
+        NVENC sessions go to the cameras with the highest pixel rates; CPU cores are shared among the
+        remaining cameras in proportion to their pixel rates. Each x264 camera then gets the slowest
+        (best compressing) preset that still keeps up with its framerate.
+        '''
+        def capacity(x, y, encoder, preset=None, threads=None):
+            if cached_only:
+                return self.calibrations[(x, y, encoder, preset, threads)]
+            return self.calibrate(x, y, encoder=encoder, preset=preset, threads=threads)
+
+        try:
+            return self.assign_from(cams, capacity)
+        except KeyError:
+            return None
+
+    def assign_from(self, cams, capacity):
+        demand = {k: x * y * fr for k, (x, y, fr) in cams.items()}
+        order = sorted(cams.keys(), key=lambda k: demand[k], reverse=True)
+
+        assignments = {}
+        n_nvenc = self.max_nvenc_sessions if self.n_nvidia_gpus > 0 else 0
+        for k in order:
+            if len(assignments) >= n_nvenc:
+                break
+            x, y, fr = cams[k]
+            nvenc_capacity = capacity(x, y, 'h264_nvenc')
+            if nvenc_capacity >= fr * self.margin:
+                assignments[k] = {'encoder': 'h264_nvenc', 'preset': None, 'threads': None,
+                                  'capacity_fps': nvenc_capacity, 'required_fps': fr, 'realtime': True}
+
+        cpu_cams = [k for k in order if k not in assignments]
+        total_demand = sum(demand[k] for k in cpu_cams)
+        for k in cpu_cams:
+            x, y, fr = cams[k]
+            threads = max(1, int(round(self.n_cores * demand[k] / total_demand))) if total_demand > 0 else 1
+
+            # Go from fast to slow presets and keep the slowest one that is still fast enough.
+            best = None
+            for preset in X264_PRESETS:
+                x264_capacity = capacity(x, y, 'libx264', preset, threads)
+                if x264_capacity < fr * self.margin:
+                    break
+                best = (preset, x264_capacity)
+
+            if best is None:
+                preset = X264_PRESETS[0]
+                assignments[k] = {'encoder': 'libx264', 'preset': preset, 'threads': threads,
+                                  'capacity_fps': self.calibrations[(x, y, 'libx264', preset, threads)],
+                                  'required_fps': fr, 'realtime': False}
+            else:
+                assignments[k] = {'encoder': 'libx264', 'preset': best[0], 'threads': threads,
+                                  'capacity_fps': best[1], 'required_fps': fr, 'realtime': True}
+
+        return assignments
@@ -1,6 +1,8 @@
 import sys
 import os
+import time
 from time import sleep
+import numpy as np
 
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtGui import QIcon
@@ -10,26 +12,35 @@ from cam_gui import Ui_CamWindow
 
 from jackfish import utils
 from jackfish.utils import Status
+from jackfish.preview_histogram import PreviewHistogram
 
 class CamUI(QtWidgets.QFrame, Ui_CamWindow):
 
-    def __init__(self, serial_number=None, device_name=None, attrs_json_path=None, parent=None, barcode=None):
+    def __init__(self, serial_number=None, device_name=None, attrs_json_path=None, parent=None, barcode=None, cam=None):
+        '''
+        cam: an already opened FlirCam (e.g. opened on a worker thread by MainUI.init_all); opened here if None
+        '''
         super(CamUI, self).__init__(None)
         self.setupUi(self)
 
         self.parent = parent
         self.barcode = barcode
         self.attrs_json_path = attrs_json_path
+        self.encoder_opts = None # set by MainUI's encoder scheduler before recording
 
         self.status = Status.STANDBY
 
         if serial_number is None: serial_number = 0
 
-        from jackfish.devices.cameras.flir import FlirCam
-        self.cam = FlirCam(serial_number=serial_number, 
-                           attrs_json_fn=attrs_json_path, 
-                           ffmpeg_location=parent.ffmpeg_location, 
-                           parent=self)
+        if cam is None:
+            from jackfish.devices.cameras.flir import FlirCam
+            self.cam = FlirCam(serial_number=serial_number, 
+                               attrs_json_fn=attrs_json_path, 
+                               ffmpeg_location=parent.ffmpeg_location, 
+                               parent=self)
+        else:
+            self.cam = cam
+            self.cam.setParent(self)
         self.serial_number = self.cam.serial_number
         
         icon_path = os.path.join(utils.ROOT_DIR,'assets/icon.png')
@@ -65,12 +76,31 @@ class CamUI(QtWidgets.QFrame, Ui_CamWindow):
         self.hist = self.preview.getHistogramWidget()
         self.hist.sigLevelsChanged.connect(self.lev_changed)
         self.hist.fillHistogram(True)
+        # The histogram is computed over a subsample on a worker thread, not by pyqtgraph on every setImage.
+        try:
+            self.preview.imageItem.sigImageChanged.disconnect(self.hist.item.imageChanged)
+        except TypeError:
+            pass
+        self.preview_histogram = PreviewHistogram(rate=2, stride=4)
+        self.preview_histogram.start()
+        self.hist_seq = 0
+        self.hist_timer = QtCore.QTimer()
+        self.hist_timer.setInterval(500)
+        self.hist_timer.timeout.connect(self.update_histogram)
+        self.hist_timer.start()
 
         self.levels = [0,255]
 
         self.preview_toggle.stateChanged.connect(self.toggle_preview)
         self.toggle_preview()
 
+        # Recording stats (frame pool / encoder process) are polled at a low rate
+        self.encoder_crash_reported = False
+        self.stats_timer = QtCore.QTimer()
+        self.stats_timer.setInterval(1000)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start()
+
         self.resizeEvent(None)
 
     def init_cam(self):
@@ -81,24 +111,56 @@ class CamUI(QtWidgets.QFrame, Ui_CamWindow):
     def start(self, record=False):
         if self.status != Status.STANDBY:
             utils.message_window("Error", "Currently recording or previewing.")
+        self.prepare(record)
+        self.release()
+        self.finish_start(record)
+
+    def prepare(self, record=False):
+        '''
+        First phase of a start: sets up recording or preview (writers, encoder, stream buffers) without touching the GUI,
+        so that MainUI can prepare all modules in parallel.
+        '''
         self.frame_num_preview = 0
         # self.preview_update_timer.start()
 
         # Start rec/preview before camera, so that no frames are missed.
         if record:
-            # use nvenc only if the camera's order is less than max nvenc sessions
-            cam_number = list(self.parent.get_modules_of_type(self.__class__).keys()).index(self.barcode)
-            use_nvenc = self.parent.n_nvidia_gpus > 0 and cam_number<self.parent.max_nvenc_sessions
-            print(f"Cam {self.cam.serial_number}:" + "Using nvenc" if use_nvenc else "NOT using nvenc")
-            self.cam.start_rec(use_nvenc=use_nvenc)
-            self.status = Status.RECORDING
+            if self.encoder_opts is not None:
+                print(f"Cam {self.cam.serial_number}: Using {self.encoder_opts['encoder']} (preset={self.encoder_opts['preset']}, threads={self.encoder_opts['threads']})")
+                rec_kwargs = {'encoder_opts': self.encoder_opts}
+            else:
+                # use nvenc only if the camera's order is less than max nvenc sessions
+                cam_number = list(self.parent.get_modules_of_type(self.__class__).keys()).index(self.barcode)
+                use_nvenc = self.parent.n_nvidia_gpus > 0 and cam_number<self.parent.max_nvenc_sessions
+                print(f"Cam {self.cam.serial_number}:" + "Using nvenc" if use_nvenc else "NOT using nvenc")
+                rec_kwargs = {'use_nvenc': use_nvenc}
+            self.encoder_crash_reported = False
+            self.cam.start_rec(**rec_kwargs)
         else:
             self.cam.start_preview()
-            self.status = Status.PREVIEWING
+
+    def release(self):
+        '''
+        Second phase of a start: begins acquisition. Returns host times before and after acquisition began.
+        '''
+        t_begin = time.time()
         self.cam.start()
+        return t_begin, time.time()
 
+    def finish_start(self, record=False):
+        self.status = Status.RECORDING if record else Status.PREVIEWING
         self.update_ui()
 
+    def abort_start(self, record=False):
+        '''
+        Undoes prepare (and release, if it got that far) of a start that failed, so the module stays on standby.
+        '''
+        self.cam.stop()
+        if record:
+            self.cam.stop_rec()
+        else:
+            self.cam.stop_preview()
+
     def stop(self):
         if self.status == Status.STANDBY:
             utils.message_window("Error", "Already on standby.")
@@ -137,6 +199,7 @@ class CamUI(QtWidgets.QFrame, Ui_CamWindow):
 
     def toggle_preview(self):
         self.preview_on = self.preview_toggle.isChecked()
+        self.cam.preview_tap.enabled = self.preview_on
 
     def toggle_trigger(self):
         self.cam.cam.TriggerMode = 'On' if self.trigger_toggle.isChecked() else 'Off'
@@ -188,11 +251,63 @@ class CamUI(QtWidgets.QFrame, Ui_CamWindow):
         self.hist.setLevels(min_level, max_level)
 
     def preview_updater(self):
-        if self.preview_on and self.cam.frame_num > self.frame_num_preview:
-            self.preview.clear()
-            self.preview.setImage(self.cam.frame.T, autoLevels=False, levels=self.levels, autoHistogramRange=False)
+        latest = self.cam.preview_tap.latest() if self.preview_on else None
+        if latest is not None and latest[0] > self.frame_num_preview:
+            frame_num, frame = latest
+            self.preview.setImage(frame.T, autoLevels=False, levels=self.levels, autoHistogramRange=False)
             self.preview.setLevels(self.levels[0],self.levels[1])
-            self.frame_num_preview = self.cam.frame_num
+            self.frame_num_preview = frame_num
+            self.preview_histogram.submit(frame)
+
+    def update_histogram(self):
+        result = self.preview_histogram.get_result()
+        if result is None or result[0] == self.hist_seq:
+            return
+        self.hist_seq, counts, levels = result
+        self.hist.item.plot.setData(np.arange(len(counts)), counts)
+        if self.auto_levels_toggle.isChecked():
+            self.hist.setLevels(*levels) # lev_changed stores them in self.levels
+
+    def update_stats(self):
+        stats = self.cam.get_rec_stats()
+        lines = [f"Grabbed: {stats['frames_grabbed']}",
+                 f"Written: {stats['frames_written']}"]
+        if 'hw_dropped' in stats:
+            lines.append(f"Lost: {stats['hw_dropped']}, incomplete: {stats['incomplete']}, late: {stats['late']}")
+        if 'acquisition' in stats:
+            acquisition = stats['acquisition']
+            lines.append(f"Acquisition ({acquisition['acquisition_mode']}): {acquisition['acquisition_cpu']*100:.0f}% CPU, "
+                         f"latency {acquisition['mean_latency']*1000:.1f} ms (max {acquisition['max_latency']*1000:.1f})")
+        if 'stream' in stats:
+            stream = stats['stream']
+            lines.append(f"Stream ({stream['buffer_mode']}): {stream['buffers_in_use']}/{stream['buffer_count']} in use, max {stream['max_backlog']}")
+            if stream['underruns']:
+                lines.append(f"Stream underruns: {stream['underruns']}")
+        if 'frames_dropped' in stats:
+            lines.append(f"Dropped ({stats['policy']}): {stats['frames_dropped']}")
+            lines.append(f"Buffer high-water: {stats['high_water']}/{stats['n_buffers']}")
+        if 'writer' in stats:
+            writer = stats['writer']
+            if 'bytes_per_s' in writer:
+                lines.append(f"Writer: {writer['bytes_per_s']/2**20:.1f} MB/s")
+                lines.append(f"Write latency: {writer['mean_write_latency']*1000:.2f} ms (max {writer['max_write_latency']*1000:.1f})")
+            if writer.get('compression_ratio') is not None:
+                lines.append(f"Disk: {writer['output_bytes_per_s']/2**20:.1f} MB/s, ratio {writer['compression_ratio']:.2f}")
+            if writer.get('ffmpeg_cpu') is not None:
+                lines.append(f"ffmpeg CPU: {writer['ffmpeg_cpu']:.1f} cores")
+            if 'chunks_pending' in writer:
+                lines.append(f"Chunks encoded: {writer['chunks_encoded']}/{writer['chunks_submitted']}")
+        if 'encoder' in stats:
+            encoder = stats['encoder']
+            lines.append(f"Encoder lag: {encoder['lag_frames']} frames")
+            if encoder['lag_frames'] > stats['n_buffers'] // 2:
+                lines.append("Encoder is falling behind!")
+            if encoder['exitcode'] not in (None, 0):
+                lines.append(f"Encoder crashed (exit code {encoder['exitcode']})")
+                if not self.encoder_crash_reported:
+                    self.encoder_crash_reported = True
+                    utils.message_window("Encoder error", f"Cam {self.cam.serial_number}: encoder process exited with code {encoder['exitcode']}.\n\n{encoder['error'] or ''}")
+        self.stats_label.setText('\n'.join(lines))
 
     def resizeEvent(self, event):
         frame_size = self.frameGeometry()
@@ -223,6 +338,9 @@ class CamUI(QtWidgets.QFrame, Ui_CamWindow):
         elif self.status == Status.PREVIEWING: # If previewing...
             event.ignore()
         elif self.status == Status.STANDBY: # If standby...
+            self.stats_timer.stop()
+            self.hist_timer.stop()
+            self.preview_histogram.stop()
             self.cam.close()
             self.parent.child_close_event(self.barcode)
         else:
@@ -8,14 +8,18 @@ from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QApplication, QFileDialog
 
-from jackfish.devices.daqs.labjack import LabJack
 from daq_gui import Ui_DAQWindow
 
 from jackfish import utils
 from jackfish.utils import Status
+from jackfish.devices.daqs.stream_metrics import histogram_percentile
 
 class DAQUI(QtWidgets.QFrame, Ui_DAQWindow):
-    def __init__(self, serial_number=None, device_name=None, attrs_json_path=None, parent=None, barcode=None):
+    def __init__(self, serial_number=None, device_name=None, attrs_json_path=None, parent=None, barcode=None, daq=None, open_args=None):
+        '''
+        daq: an already opened LabJack (e.g. opened on a worker thread by MainUI.init_all); opened here if None
+        open_args: extra keyword arguments for LabJack() when it is opened here
+        '''
         super(DAQUI, self).__init__(None)
         self.setupUi(self)
 
@@ -25,9 +29,18 @@ class DAQUI(QtWidgets.QFrame, Ui_DAQWindow):
         self.status = Status.STANDBY
 
         self.scanrate = 1
+        self.segment_scans = None
+        self.segment_sec = None
+        self.record_format = 'float64'
+        self.write_queue_sec = 10
+        self.skip_budget = None
+        self.max_backlog_sec = 1
 
         # Initialize Labjack
-        self.daq = LabJack(serial_number=serial_number, name=device_name)
+        if daq is None:
+            from jackfish.devices.daqs.labjack import LabJack
+            daq = LabJack(serial_number=serial_number, name=device_name, **(open_args or {}))
+        self.daq = daq
         self.serial_number = self.daq.serial_number
 
         ### UI ###
@@ -68,6 +81,11 @@ class DAQUI(QtWidgets.QFrame, Ui_DAQWindow):
         self.preview_timer = QtCore.QTimer()
         self.preview_timer.timeout.connect(self.preview_updater)
 
+        # Stream metrics, polled at a low rate
+        self.stats_timer = QtCore.QTimer()
+        self.stats_timer.setInterval(1000)
+        self.stats_timer.timeout.connect(self.update_stats)
+
         self.preview_slider.setMinimum(2)
         self.preview_slider.setMaximum(int(self.scanrate * 10)) # 10 seconds of data
         self.preview_slider.setValue(int(self.scanrate)) # 1 second of data
@@ -107,6 +125,24 @@ class DAQUI(QtWidgets.QFrame, Ui_DAQWindow):
                 self.trigger_chan_edit.setText(trigger_chs)
                 self.set_trigger_chans()
 
+            if 'segment_scans' in attrs_dict.keys():
+                self.segment_scans = attrs_dict['segment_scans']
+
+            if 'segment_minutes' in attrs_dict.keys():
+                self.segment_sec = attrs_dict['segment_minutes'] * 60
+
+            if 'record_format' in attrs_dict.keys():
+                self.record_format = attrs_dict['record_format']
+
+            if 'write_queue_sec' in attrs_dict.keys():
+                self.write_queue_sec = attrs_dict['write_queue_sec']
+
+            if 'skip_budget' in attrs_dict.keys():
+                self.skip_budget = attrs_dict['skip_budget']
+
+            if 'max_backlog_sec' in attrs_dict.keys():
+                self.max_backlog_sec = attrs_dict['max_backlog_sec']
+
             if 'labjack_settings' in attrs_dict.keys():
                 labjack_settings = attrs_dict['labjack_settings']
                 # Write additional settings from attrs_json
@@ -114,29 +150,54 @@ class DAQUI(QtWidgets.QFrame, Ui_DAQWindow):
                     self.daq.set_attrs(labjack_settings)
 
     def start(self, record=False):
-
-        n_channels = len(self.input_channels.keys())
-        print(n_channels)
-        print('0000')
-        scansPerRead = int(self.scanrate/n_channels)
         if self.status != Status.STANDBY:
             utils.message_window("Error", "Currently recording or previewing.")
-        self.preview_timer.start()
+        self.prepare(record)
+        self.release()
+        self.finish_start(record)
+
+    def prepare(self, record=False):
+        '''
+        First phase of a start: opens the record file and configures the stream without touching the GUI,
+        so that MainUI can prepare all modules in parallel.
+        '''
+        n_channels = len(self.input_channels.keys())
+        scansPerRead = int(self.scanrate/n_channels)
         if record:
-            self.status = Status.RECORDING
-            self.daq.start_stream(do_record=record, record_filepath=self.write_path, input_channels=self.input_channels, scanRate=self.scanrate, scansPerRead = scansPerRead, preview_queue_len_sec=15)
+            self.daq.prepare_stream(do_record=record, record_filepath=self.write_path, input_channels=self.input_channels, scanRate=self.scanrate, scansPerRead = scansPerRead, preview_queue_len_sec=15, segment_scans=self.segment_scans, segment_sec=self.segment_sec, record_format=self.record_format, 
+                                     write_queue_sec=self.write_queue_sec, skip_budget=self.skip_budget, max_backlog_sec=self.max_backlog_sec)
             # self.daq.start_stream(do_record=record, record_filepath=self.write_path, input_channels=self.input_channels, scanRate=self.scanrate, preview_queue_len_sec=15, socket_target=(None,25025))
         else:
-            self.status = Status.PREVIEWING
-            self.daq.start_stream(do_record=False, input_channels=self.input_channels, scanRate=self.scanrate, preview_queue_len_sec=15)
-
+            self.daq.prepare_stream(do_record=False, input_channels=self.input_channels, scanRate=self.scanrate, preview_queue_len_sec=15, 
+                                    write_queue_sec=self.write_queue_sec, max_backlog_sec=self.max_backlog_sec)
+
+    def release(self):
+        '''
+        Second phase of a start: starts the stream. Returns host times before and after the stream started.
+        '''
+        t_begin = time.time()
+        self.daq.begin_stream()
+        return t_begin, time.time()
+
+    def finish_start(self, record=False):
+        self.preview_timer.start()
+        self.stats_timer.start()
+        self.status = Status.RECORDING if record else Status.PREVIEWING
         self.update_ui()
 
+    def abort_start(self, record=False):
+        '''
+        Undoes prepare (and release, if it got that far) of a start that failed, so the module stays on standby.
+        '''
+        self.daq.abort_stream()
+
     def stop(self):
         if self.status == Status.STANDBY:
             utils.message_window("Error", "Already on standby.")
         self.preview_timer.stop()
+        self.stats_timer.stop()
         self.daq.stop_stream()
+        self.update_stats()
         self.status = Status.STANDBY
 
         self.update_ui()
@@ -215,9 +276,18 @@ class DAQUI(QtWidgets.QFrame, Ui_DAQWindow):
             self.show_preview = True
 
     def preview_updater(self):
+        if self.status != Status.STANDBY and getattr(self.daq, 'stream_error', None) is not None:
+            error = self.daq.stream_error
+            if self.parent is not None and self.parent.status != Status.STANDBY:
+                self.parent.stop() # stops every device, so the main window and the other recordings do not carry on without the DAQ
+            else:
+                self.stop()
+            utils.message_window("DAQ stream error", f"DAQ {self.serial_number}: {error}\n\nThe recording was stopped.")
+            return
+
         if self.show_preview:
 
-            self.data = list(self.daq.preview_queue)[self.chan_preview_idx:-1:len(self.input_channels)]
+            self.data = self.daq.preview_queue.latest(self.chan_preview_idx, self.slider_val)
             try:
                 data_to_plot = self.data[-self.slider_val:]
                 curve_t = np.arange(0, len(data_to_plot)) / self.scanrate * 1000 # ms
@@ -229,6 +299,17 @@ class DAQUI(QtWidgets.QFrame, Ui_DAQWindow):
             self.preview.show() 
 
 
+    def update_stats(self):
+        stats = self.daq.get_stream_stats()
+        lines = [f"Scan rate: {stats['achieved_scan_rate']:.1f}/{stats['scan_rate'] or 0:.0f} Hz, scans: {stats['scans']}, "
+                 f"skipped: {stats['skipped_scans']}, dropped: {stats['dropped_scans']}",
+                 f"Read interval p99 < {histogram_percentile(stats['read_interval_ms'], 99)} ms (max {stats['read_interval_ms']['max']:.0f}), "
+                 f"backlog max: device {stats['device_backlog']['max']}, LJM {stats['ljm_backlog']['max']}, queue {stats['queue_depth']} (max {stats['max_queue_depth']})",
+                 f"Callback p99 < {histogram_percentile(stats['callback_ms'], 99)} ms (max {stats['callback_ms']['max']:.2f}), read errors: {stats['read_errors']}"]
+        if stats['teardown_sec'] is not None:
+            lines[-1] += f", teardown {stats['teardown_sec']*1000:.0f} ms"
+        self.stats_label.setText("\n".join(lines))
+
     def trigger(self):
         write_states = np.ones(len(self.trigger_chans), dtype=int)
         self.daq.write(self.trigger_chans, write_states.tolist())
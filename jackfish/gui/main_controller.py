@@ -1,22 +1,28 @@
+import time
+t_launch = time.perf_counter()
 import os
 import sys
 import random
 import json
-import time
+import threading
+import queue
 from datetime import timedelta
 
 
 from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import QApplication, QFileDialog, QInputDialog, QMessageBox
+from PyQt5.QtWidgets import QApplication, QFileDialog, QInputDialog, QMessageBox, QProgressDialog
 from PyQt5.QtGui import QPixmap, QIcon
-from PyQt5.QtCore import QTimer
-from cam_controller import CamUI
-from daq_controller import DAQUI
-from review_controller import REVUI
+from PyQt5.QtCore import QTimer, Qt
 import main_gui
 
 from jackfish import utils
 from jackfish.utils import Status
+from jackfish.encoder_scheduler import EncoderScheduler
+from jackfish.devices.discovery import DeviceDiscovery
+
+STARTUP = utils.StartupProfiler()
+STARTUP.t0 = t_launch
+STARTUP.mark('imports')
 
 class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
     def __init__(self, parent=None):
@@ -37,9 +43,15 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         self.expt_path = os.environ['HOME']
         self.new_path_set = False
 
+        STARTUP.mark('main window setup')
         self.n_nvidia_gpus = utils.count_nvidia_gpus()
         self.max_nvenc_sessions = 2
         self.ffmpeg_location = utils.get_ffmpeg_location()
+        STARTUP.mark('GPU/ffmpeg probes')
+        self.schedule_encoders = True
+        self.encoder_scheduler = None
+        self.encoder_calibration_pending = False
+        self.encoder_calibration_report = False
 
         self.modules = {}
 
@@ -68,6 +80,12 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         self.load_preset_menu.setStatusTip('Load a preset')
         self.load_preset_menu.triggered.connect(self.load_preset)
 
+        self.calibrate_encoders_menu.setStatusTip('Measures encoder throughput for the initialized cameras')
+        self.calibrate_encoders_menu.triggered.connect(self.calibrate_encoders)
+
+        self.init_all_menu.setStatusTip('Opens every camera and DAQ in the preset in parallel')
+        self.init_all_menu.triggered.connect(self.init_all)
+
         # Elapsed time
         self.elapsed_timer = QTimer()
         self.elapsed_timer.setSingleShot(False)
@@ -85,10 +103,25 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         self.timer_updater.setInterval(1000)
         self.timer_updater.timeout.connect(self.update_timer)
 
+        # Device discovery: enumerates attached cameras and DAQs in the background;
+        # preset devices are marked found / not found in the dropdowns when it finishes
+        self.discovery = DeviceDiscovery()
+        self.discovery.start()
+        self.encoder_calibration_timer = QTimer()
+        self.encoder_calibration_timer.setInterval(500)
+        self.encoder_calibration_timer.timeout.connect(self.check_encoder_calibration)
+
+        self.discovery_timer = QTimer()
+        self.discovery_timer.setSingleShot(False)
+        self.discovery_timer.setInterval(200)
+        self.discovery_timer.timeout.connect(self.check_discovery)
+        self.discovery_timer.start()
+
         #### Import presets ####
 
         # self.load_file_menu.triggered.connect(self.init_review)
         self.load_preset(init=True)
+        STARTUP.mark('default preset')
         
     
     def clear_default(self):
@@ -143,6 +176,12 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
             self.ffmpeg_location = main_presets['ffmpeg_location']
         if "max_nvenc_sessions" in main_presets.keys():
             self.max_nvenc_sessions = main_presets['max_nvenc_sessions']
+        if "schedule_encoders" in main_presets.keys():
+            self.schedule_encoders = main_presets['schedule_encoders']
+        if self.encoder_scheduler is not None:
+            self.encoder_scheduler.cancel()
+        self.encoder_scheduler = None # ffmpeg location or nvenc sessions may have changed
+        self.start_encoder_calibration()
 
         self.cam_presets = preset_dict['cameras']
         self.cam_names = list(self.cam_presets.keys())
@@ -154,6 +193,34 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         self.daq_names_drop.addItems(self.daq_names)
         self.cam_names_drop.clear()
         self.cam_names_drop.addItems(self.cam_names)
+        self.update_device_presence()
+
+    def check_discovery(self):
+        if not self.discovery.is_done():
+            return
+        self.discovery_timer.stop()
+        n_cams, n_daqs = len(self.discovery.devices['cameras']), len(self.discovery.devices['daqs'])
+        print(f"Discovery: found {n_cams} cameras and {n_daqs} DAQs in {self.discovery.scan_time:.2f} s.")
+        self.statusBar.showMessage(f"Found {n_cams} cameras and {n_daqs} DAQs.")
+        self.update_device_presence()
+
+    def update_device_presence(self):
+        '''
+        Marks each preset device in the dropdowns as found or not found by device discovery.
+        '''
+        if not hasattr(self, 'cam_presets'):
+            return
+        for kind, presets, names, drop in (('cameras', self.cam_presets, self.cam_names, self.cam_names_drop),
+                                           ('daqs', self.daq_presets, self.daq_names, self.daq_names_drop)):
+            for i, name in enumerate(names):
+                serial_number, _ = self.get_device_preset(presets, name)
+                status = self.discovery.status(kind, serial_number)
+                if status == 'unknown':
+                    drop.setItemText(i, name)
+                elif status == 'cached':
+                    drop.setItemText(i, f"{name} (found last time)")
+                else:
+                    drop.setItemText(i, f"{name} ({'found' if status == 'present' else 'not found'})")
 
     def set_save_dir(self, save_dir=None):
         # options = QFileDialog.Options()
@@ -206,25 +273,43 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
             module.set_write_path(dir=self.expt_path)
     
     # def init_review(self):
+    #     from review_controller import REVUI
     #     reviewUI = REVUI()
     #     reviewUI.show()
 
+    def get_device_preset(self, presets, name):
+        serial_number = presets[name]['serial_number'] if 'serial_number' in presets[name].keys() else None
+        if serial_number == "": serial_number = None
+        attrs_json = presets[name]['attrs_json'] if 'attrs_json' in presets[name].keys() else None
+        if attrs_json == "": attrs_json = None
+        return serial_number, attrs_json
+
+    def is_initialized(self, serial_number):
+        return serial_number in [str(module.serial_number) for module in self.modules.values()]
+
     def init_daq(self):
         daq_drop_index = self.daq_names_drop.currentIndex()
         daq_name = self.daq_names[daq_drop_index]
-        daq_serial_number = self.daq_presets[daq_name]['serial_number'] if 'serial_number' in self.daq_presets[daq_name].keys() else None
-        if daq_serial_number == "": daq_serial_number = None
-        daq_attrs_json = self.daq_presets[daq_name]['attrs_json'] if 'attrs_json' in self.daq_presets[daq_name].keys() else None
-        if daq_attrs_json == "": daq_attrs_json = None
+        daq_serial_number, _ = self.get_device_preset(self.daq_presets, daq_name)
 
-        if daq_serial_number in [str(module.serial_number) for module in self.modules.values()]:
+        if self.is_initialized(daq_serial_number):
             title=f"DAQ initialization error"
             text=f"DAQ (serial number: {daq_serial_number}) is already initialized."
             utils.message_window(title, text)
             return
+        if self.discovery.status('daqs', daq_serial_number) == 'missing':
+            utils.message_window("DAQ initialization error", f"DAQ (serial number: {daq_serial_number}) was not found.")
+            return
+
+        self.add_daq_module(daq_name)
+
+    def add_daq_module(self, daq_name, daq=None):
+        daq_serial_number, daq_attrs_json = self.get_device_preset(self.daq_presets, daq_name)
 
         barcode = random.randint(0, 2**31-1)
-        daqUI = DAQUI(serial_number=daq_serial_number, device_name=daq_name, attrs_json_path=daq_attrs_json, parent=self, barcode=barcode)
+        from daq_controller import DAQUI
+        daqUI = DAQUI(serial_number=daq_serial_number, device_name=daq_name, attrs_json_path=daq_attrs_json, parent=self, barcode=barcode, daq=daq, 
+                      open_args=self.discovery.labjack_open_args(daq_serial_number))
         
         
         daqUI.set_write_path(dir=self.expt_path)
@@ -236,28 +321,215 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
     def init_cam(self):
         cam_drop_index = self.cam_names_drop.currentIndex()
         cam_name = self.cam_names[cam_drop_index]
-        cam_serial_number = self.cam_presets[cam_name]['serial_number'] if 'serial_number' in self.cam_presets[cam_name].keys() else None
-        if cam_serial_number == "": cam_serial_number = None
-        cam_attrs_json = self.cam_presets[cam_name]['attrs_json'] if 'attrs_json' in self.cam_presets[cam_name].keys() else None
-        if cam_attrs_json == "": cam_attrs_json = None
+        cam_serial_number, _ = self.get_device_preset(self.cam_presets, cam_name)
 
-        if cam_serial_number in [str(module.serial_number) for module in self.modules.values()]:
+        if self.is_initialized(cam_serial_number):
             title=f"Camera initialization error"
             text=f"Camera (serial number: {cam_serial_number}) is already initialized."
             utils.message_window(title, text)
             return
+        if self.discovery.status('cameras', cam_serial_number) == 'missing':
+            utils.message_window("Camera initialization error", f"Camera (serial number: {cam_serial_number}) was not found.")
+            return
+
+        self.add_cam_module(cam_name)
+
+    def add_cam_module(self, cam_name, cam=None):
+        cam_serial_number, cam_attrs_json = self.get_device_preset(self.cam_presets, cam_name)
 
         barcode = random.randint(0, 2**31-1)
-        camUI = CamUI(serial_number=cam_serial_number, device_name=cam_name, attrs_json_path=cam_attrs_json, parent=self, barcode=barcode)
+        from cam_controller import CamUI
+        camUI = CamUI(serial_number=cam_serial_number, device_name=cam_name, attrs_json_path=cam_attrs_json, parent=self, barcode=barcode, cam=cam)
         camUI.set_write_path(dir=self.expt_path)
         camUI.show()
         self.modules[barcode] = camUI
 
+        self.start_encoder_calibration()
         self.update_ui()
 
-    def get_modules_of_type(self, mod_class=CamUI):
+    def init_all(self):
+        '''
+        Opens every camera and DAQ of the loaded preset that is not initialized yet, each on its own worker thread.
+        Device windows are created on the GUI thread as the devices finish opening; errors are reported once all are done.
+        '''
+        if not hasattr(self, 'cam_presets'):
+            utils.message_window("Init all", "Load a preset first.")
+            return
+        jobs = [('cam', name) for name in self.cam_names if not self.is_initialized(self.get_device_preset(self.cam_presets, name)[0])]
+        jobs += [('daq', name) for name in self.daq_names if not self.is_initialized(self.get_device_preset(self.daq_presets, name)[0])]
+        # Devices that discovery did not find are reported without trying to open them
+        missing = [(kind, name) for kind, name in jobs 
+                   if self.discovery.status('cameras' if kind == 'cam' else 'daqs', 
+                                            self.get_device_preset(self.cam_presets if kind == 'cam' else self.daq_presets, name)[0]) == 'missing']
+        jobs = [job for job in jobs if job not in missing]
+        if len(jobs) == 0 and len(missing) > 0:
+            utils.message_window("Init all", "None of the remaining devices were found:\n\n" + "\n".join([name for _, name in missing]))
+            return
+        if len(jobs) == 0:
+            utils.message_window("Init all", "All devices in the preset are already initialized.")
+            return
+
+        from jackfish.devices.cameras.flir import FlirCam
+        from jackfish.devices.daqs.labjack import LabJack
+        gui_thread = QApplication.instance().thread()
+        init_results = queue.Queue()
+
+        def open_device(kind, name):
+            try:
+                if kind == 'cam':
+                    serial_number, attrs_json = self.get_device_preset(self.cam_presets, name)
+                    device = FlirCam(serial_number=serial_number if serial_number is not None else 0, 
+                                     attrs_json_fn=attrs_json, 
+                                     ffmpeg_location=self.ffmpeg_location)
+                    device.moveToThread(gui_thread) # so that CamUI can adopt it
+                else:
+                    serial_number, _ = self.get_device_preset(self.daq_presets, name)
+                    device = LabJack(serial_number=serial_number, name=name, **self.discovery.labjack_open_args(serial_number))
+                init_results.put((kind, name, device, None))
+            except Exception as e:
+                init_results.put((kind, name, None, e))
+
+        progress = QProgressDialog("Initializing devices...", None, 0, len(jobs), self)
+        progress.setWindowTitle("Init all")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.setValue(0)
+        errors = [f"{name}: not found" for _, name in missing]
+
+        def collect_results():
+            while not init_results.empty():
+                kind, name, device, error = init_results.get()
+                if error is not None:
+                    errors.append(f"{name}: {error}")
+                else:
+                    try:
+                        if kind == 'cam':
+                            self.add_cam_module(name, cam=device)
+                        else:
+                            self.add_daq_module(name, daq=device)
+                    except Exception as e:
+                        errors.append(f"{name}: {e}")
+                progress.setValue(progress.value() + 1)
+                progress.setLabelText(f"Initialized {progress.value()}/{len(jobs)} devices ({name}).")
+
+            if progress.value() >= len(jobs):
+                self.init_all_timer.stop()
+                progress.close()
+                if len(errors) > 0:
+                    utils.message_window("Init all", "Some devices could not be initialized:\n\n" + "\n".join(errors))
+                self.update_ui()
+
+        for kind, name in jobs:
+            threading.Thread(target=open_device, args=(kind, name), daemon=True).start()
+
+        self.init_all_timer = QTimer()
+        self.init_all_timer.setInterval(100)
+        self.init_all_timer.timeout.connect(collect_results)
+        self.init_all_timer.start()
+
+    def get_modules_of_type(self, mod_class=None):
+        if mod_class is None:
+            from cam_controller import CamUI
+            mod_class = CamUI
         return {barcode:module for barcode, module in self.modules.items() if isinstance(module, mod_class)}
 
+    def get_encoder_scheduler(self):
+        if self.encoder_scheduler is None:
+            self.encoder_scheduler = EncoderScheduler(ffmpeg_location=self.ffmpeg_location, 
+                                                      n_nvidia_gpus=self.n_nvidia_gpus, 
+                                                      max_nvenc_sessions=self.max_nvenc_sessions)
+        return self.encoder_scheduler
+
+    def get_encoded_cams(self):
+        # Cameras that encode while recording, as {barcode: (x, y, framerate)}
+        cams = {}
+        for barcode, module in self.get_modules_of_type().items():
+            # raw and chunked recordings are encoded offline, not in real time; ffv1 has no encoder choice
+            if module.cam.recording_mode in ('thread', 'process') and module.cam.video_codec == 'h264' and module.cam.framerate is not None:
+                cams[barcode] = (module.cam.x, module.cam.y, module.cam.framerate)
+        return cams
+
+    def start_encoder_calibration(self, force=False, report=False):
+        '''
+        Calibrates the encoders of the initialized cameras on a background thread, so that recording can start
+        from cached calibrations. Only runs on standby; a request made while a calibration is running is queued.
+        force: measure again even if calibrations are cached
+        report: show the results when done
+        '''
+        self.encoder_calibration_report = self.encoder_calibration_report or report
+        if not self.schedule_encoders or self.status != Status.STANDBY:
+            return
+        scheduler = self.get_encoder_scheduler()
+        if scheduler.is_calibrating():
+            self.encoder_calibration_pending = True
+            return
+        cams = self.get_encoded_cams()
+        if len(cams) == 0 and not self.encoder_calibration_report:
+            return
+        scheduler.calibrate_async(cams, force=force)
+        self.statusBar.showMessage("Calibrating encoders...")
+        self.encoder_calibration_timer.start()
+
+    def check_encoder_calibration(self):
+        scheduler = self.get_encoder_scheduler()
+        if scheduler.is_calibrating():
+            return
+        self.encoder_calibration_timer.stop()
+        if self.status != Status.STANDBY:
+            return # cancelled by start; resumed on stop
+        if self.encoder_calibration_pending: # cameras were added meanwhile
+            self.encoder_calibration_pending = False
+            self.start_encoder_calibration()
+            return
+        self.statusBar.showMessage("Encoder calibration done.")
+        if self.encoder_calibration_report:
+            self.encoder_calibration_report = False
+            self.report_encoder_calibration()
+
+    def calibrate_encoders(self):
+        if self.status != Status.STANDBY:
+            utils.message_window("Encoder calibration", "Stop preview or recording first.")
+            return
+        self.start_encoder_calibration(force=True, report=True)
+
+    def report_encoder_calibration(self):
+        assignments = self.get_encoder_scheduler().assign(self.get_encoded_cams(), cached_only=True) or {}
+
+        lines = []
+        for barcode, assignment in assignments.items():
+            module = self.modules[barcode]
+            lines.append(f"Cam {module.serial_number}: {assignment['encoder']} {assignment['preset'] or ''} "
+                         f"threads={assignment['threads']} ({assignment['capacity_fps']:.0f}/{assignment['required_fps']:.0f} fps)"
+                         + ("" if assignment['realtime'] else " NOT REAL-TIME"))
+        utils.message_window("Encoder calibration", "\n".join(lines) if len(lines) > 0 else "No cameras to calibrate.")
+
+    def assign_encoders(self):
+        '''
+        Assigns an encoder to each camera before recording. Returns False if recording should not start.
+        Only cached calibrations are used (see start_encoder_calibration); without them the cameras
+        keep their default encoder choice.
+        '''
+        cam_modules = self.get_modules_of_type()
+        for module in cam_modules.values():
+            module.encoder_opts = None
+        if not self.schedule_encoders or len(cam_modules) == 0:
+            return True
+
+        assignments = self.get_encoder_scheduler().assign(self.get_encoded_cams(), cached_only=True)
+        if assignments is None:
+            print("Encoders are not calibrated yet; using the default encoders.")
+            return True
+        for barcode, assignment in assignments.items():
+            cam_modules[barcode].encoder_opts = assignment
+
+        not_realtime = [barcode for barcode, assignment in assignments.items() if not assignment['realtime']]
+        if len(not_realtime) > 0:
+            text = "\n".join([f"Cam {cam_modules[barcode].serial_number}: encoder reaches {assignments[barcode]['capacity_fps']:.0f} fps "
+                              f"but {assignments[barcode]['required_fps']:.0f} fps is required." for barcode in not_realtime])
+            reply = QMessageBox.question(self, "Encoders cannot keep up", text + "\n\nRecord anyway?", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            return reply == QMessageBox.Yes
+        return True
+
     def control(self):
         record = (self.sender().text() == "Record")
         if self.status == Status.STANDBY:
@@ -266,19 +538,30 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
             self.stop()
 
     def start(self, record=False):
+        if self.encoder_scheduler is not None:
+            self.encoder_scheduler.cancel() # a background calibration would compete with acquisition
         if record:
             if self.status == Status.PREVIEWING:
                 self.stop()
+
+            if not self.assign_encoders():
+                print('Record cancelled')
+                self.update_ui()
+                return
             
-            for module in self.modules.values():
-                module.start(record=True)
+            started = self.start_modules(record=True)
+        else:
+            started = self.start_modules(record=False)
 
+        if len(started) == 0:
+            print('Record not started' if record else 'Preview not started')
+            QTimer.singleShot(0, self.start_encoder_calibration) # resumes the calibration cancelled above
+            self.update_ui()
+            return
+        if record:
             print('Record Started')
             self.status = Status.RECORDING
         else:
-            for module in self.modules.values():
-                module.start(record=False)
-
             print("Preview Started")
             self.status = Status.PREVIEWING
         
@@ -289,9 +572,73 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
 
         self.update_ui()
 
+    def start_modules(self, record=False):
+        '''
+        Two-phase start: every module prepares its writers and threads in parallel, then all modules begin acquisition
+        together once the slowest one is ready. A module that fails to prepare or release is reported, its partial start
+        is undone and it is left on standby. A recording starts all or nothing: if any module fails, the modules that
+        did start are undone as well. Returns the barcodes of the modules that started.
+        The start skew of each device is written to start_skew.json in the experiment directory when recording.
+        '''
+        modules = dict(self.modules)
+        barrier = threading.Barrier(len(modules)) if len(modules) > 0 else None
+        release_times = {}
+        errors = {}
+
+        def start_module(barcode, module):
+            try:
+                module.prepare(record)
+            except Exception as e:
+                errors[barcode] = e
+            barrier.wait()
+            if barcode not in errors:
+                try:
+                    release_times[barcode] = module.release()
+                except Exception as e:
+                    errors[barcode] = e
+
+        threads = [threading.Thread(target=start_module, args=(barcode, module), daemon=True) for barcode, module in modules.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        undo = list(errors.keys())
+        if record and len(errors) > 0:
+            undo += list(release_times.keys())
+            release_times = {}
+        for barcode in release_times.keys():
+            modules[barcode].finish_start(record)
+        for barcode in undo:
+            try:
+                modules[barcode].abort_start(record)
+            except Exception as e:
+                print(f"{modules[barcode].__class__.__name__} {modules[barcode].serial_number}: could not undo the start: {e}")
+        if len(errors) > 0:
+            text = "\n".join([f"{modules[barcode].__class__.__name__} {modules[barcode].serial_number}: {e}" for barcode, e in errors.items()])
+            if record:
+                text += "\n\nThe recording was not started."
+            utils.message_window("Start error", text)
+
+        if len(release_times) == 0:
+            return []
+        t_first = min(t_begin for t_begin, _ in release_times.values())
+        skews = [{'module': modules[barcode].__class__.__name__,
+                  'serial_number': str(modules[barcode].serial_number),
+                  'release_time': t_begin,
+                  'skew_ms': (t_begin - t_first) * 1000,
+                  'start_duration_ms': (t_end - t_begin) * 1000} for barcode, (t_begin, t_end) in release_times.items()]
+        for skew in skews:
+            print(f"{skew['module']} {skew['serial_number']}: start skew {skew['skew_ms']:.2f} ms, start took {skew['start_duration_ms']:.2f} ms")
+        if record:
+            with open(os.path.join(self.expt_path, 'start_skew.json'), 'w') as f:
+                json.dump({'release_time': t_first, 'devices': skews}, f, indent=4)
+        return list(release_times.keys())
+
     def stop(self):
         for module in self.modules.values():
-            module.stop()
+            if module.status != Status.STANDBY: # e.g. a module that failed to start
+                module.stop()
 
         if self.status == Status.PREVIEWING: 
             print("Preview Finished")
@@ -306,6 +653,8 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         if self.timer_checkBox.isChecked():
             self.stop_timer()
 
+        # Finishes a calibration cancelled by start; deferred so that a Record click that stops the preview does not start one
+        QTimer.singleShot(0, self.start_encoder_calibration)
         self.update_ui()
 
     def start_elapsed_timer(self):
@@ -358,6 +707,7 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         if self.status == Status.RECORDING: # If recording...
             self.cam_init_push.setEnabled(False)
             self.daq_init_push.setEnabled(False)
+            self.init_all_menu.setEnabled(False)
             self.set_save_dir_push.setEnabled(False)
             self.set_expt_push.setEnabled(False)
 
@@ -374,6 +724,7 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         elif self.status == Status.PREVIEWING: # If previewing...
             self.cam_init_push.setEnabled(False)
             self.daq_init_push.setEnabled(False)
+            self.init_all_menu.setEnabled(False)
             self.set_save_dir_push.setEnabled(False)
             self.set_expt_push.setEnabled(False)
 
@@ -390,6 +741,7 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
         elif self.status == Status.STANDBY: # If standby...
             self.cam_init_push.setEnabled(True)
             self.daq_init_push.setEnabled(True)
+            self.init_all_menu.setEnabled(True)
             self.set_save_dir_push.setEnabled(True)
             self.set_expt_push.setEnabled(True)
 
@@ -487,9 +839,22 @@ class MainUI(QtWidgets.QMainWindow, main_gui.Ui_MainWindow):
     #         print("Nothing to stop.")
 
 def main():
+    # --profile-startup: print how long each startup phase took once the window is up, then quit
+    profile_startup = '--profile-startup' in sys.argv
+    if profile_startup:
+        sys.argv.remove('--profile-startup')
+
     app = QApplication(sys.argv)
+    STARTUP.mark('QApplication')
     form = MainUI()
     form.show()
+    STARTUP.mark('window shown')
+    if profile_startup:
+        def report():
+            STARTUP.mark('first event loop pass')
+            STARTUP.report()
+            app.quit()
+        QTimer.singleShot(0, report)
     app.exec_()
 
 
@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+
+def sampled_histogram(frame, stride=4, n_bins=256):
+    '''
+    Histogram of an 8-bit frame over every stride-th pixel in each dimension.
+    '''
+    return np.bincount(frame[::stride, ::stride].ravel(), minlength=n_bins)
+
+def percentile_levels(counts, low_pct=0.5, high_pct=99.5):
+    '''
+    (low, high) pixel values below which low_pct and high_pct percent of the histogram counts fall.
+    Both stay within the histogram's range with low < high, also for a flat (e.g. saturated) frame.
+    '''
+    cdf = np.cumsum(counts)
+    max_level = len(counts) - 1
+    if cdf[-1] == 0:
+        return 0, max_level
+    low = int(np.searchsorted(cdf, cdf[-1] * low_pct / 100))
+    high = int(np.searchsorted(cdf, cdf[-1] * high_pct / 100))
+    high = min(max(high, low + 1), max_level)
+    low = min(low, high - 1)
+    return low, high
+
+class PreviewHistogram():
+    '''
+    Computes the preview histogram and percentile-based level suggestions on a worker thread, at most rate times per second.
+
+    The display submits frames as often as it likes; only the most recent one is used when the worker wakes up.
+    '''
+    def __init__(self, rate=2, stride=4, low_pct=0.5, high_pct=99.5, n_bins=256):
+        self.rate = rate
+        self.stride = stride
+        self.low_pct = low_pct
+        self.high_pct = high_pct
+        self.n_bins = n_bins
+
+        self.pending = None
+        self.result = None # (sequence number, counts, (low, high))
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        def worker():
+            seq = 0
+            while not self.stop_event.wait(1 / self.rate):
+                frame, self.pending = self.pending, None
+                if frame is None:
+                    continue
+                counts = sampled_histogram(frame, self.stride, self.n_bins)
+                seq += 1
+                self.result = (seq, counts, percentile_levels(counts, self.low_pct, self.high_pct))
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=worker, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def submit(self, frame):
+        '''
+        frame: 8-bit frame that will not be modified afterwards (e.g. a copy from PreviewTap.latest)
+        '''
+        self.pending = frame
+
+    def get_result(self):
+        return self.result
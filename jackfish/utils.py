@@ -1,4 +1,7 @@
 import os
+import json
+import time
+import shutil
 import subprocess
 from enum import Enum
 from PyQt5.QtWidgets import QMessageBox
@@ -13,25 +16,89 @@ def message_window(title="Alert", text=""):
     msg.setText(text)
     msg.exec_()
 
-def count_nvidia_gpus():
+CONFIG_DIR = os.path.expanduser('~/.config/jackfish')
+ENV_CACHE_PATH = os.path.join(CONFIG_DIR, 'env_cache.json')
+ENV_CACHE_MAX_AGE = 7 * 24 * 3600 # seconds
+STARTUP_BUDGET = 2.0 # seconds from launch until the main window is up
+
+def get_cached_probe(name, key, probe):
+    '''
+    Returns probe(), cached on disk under name.
+    key: JSON-serializable description of what the result depends on (e.g. binary paths and mtimes);
+         the cached value is reused only while key is unchanged and the entry is younger than ENV_CACHE_MAX_AGE.
+    '''
+    cache = {}
+    try:
+        with open(ENV_CACHE_PATH, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        pass
+    entry = cache.get(name)
+    if entry is not None and entry['key'] == key and time.time() - entry['time'] < ENV_CACHE_MAX_AGE:
+        return entry['value']
+
+    value = probe()
+    cache[name] = {'key': key, 'value': value, 'time': time.time()}
+    try:
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        with open(ENV_CACHE_PATH + '.tmp', 'w') as f:
+            json.dump(cache, f, indent=4)
+        os.replace(ENV_CACHE_PATH + '.tmp', ENV_CACHE_PATH)
+    except OSError:
+        pass
+    return value
+
+def binary_key(name):
+    path = shutil.which(name)
+    return {'path': path, 'mtime': os.path.getmtime(path) if path is not None else None}
+
+def probe_nvidia_gpus():
     try:
         ps = subprocess.Popen(('nvidia-smi', '--query-gpu=name', '--format=csv,noheader'), stdout=subprocess.PIPE)
         output = subprocess.check_output(('wc', '-l'), stdin=ps.stdout).decode()
         ps.wait()
-        n_gpus = int(output)
+        return int(output)
+    except Exception: # this command not being found can raise quite a few different errors depending on the configuration
+        return 0
 
+def count_nvidia_gpus():
+    # Invalidated when nvidia-smi changes (driver update) or the set of GPUs seen by the driver changes.
+    gpus_dir = '/proc/driver/nvidia/gpus'
+    key = {'nvidia-smi': binary_key('nvidia-smi'), 'gpus': sorted(os.listdir(gpus_dir)) if os.path.isdir(gpus_dir) else None}
+    n_gpus = get_cached_probe('nvidia_gpus', key, probe_nvidia_gpus)
+    if n_gpus > 0:
         print(f'{n_gpus} Nvidia GPUs detected!')
-        return n_gpus
-    except Exception: # this command not being found can raise quite a few different errors depending on the configuration
+    else:
         print('No Nvidia GPU in system!')
-        return 0
+    return n_gpus
 
 def get_ffmpeg_location():
-    try:
-        path = subprocess.check_output("which ffmpeg", shell=True).decode()
-        parent_dir = path[:path.rindex(os.sep)]
+    # shutil.which is as cheap as reading the env cache, so this is not cached
+    ffmpeg_path = shutil.which('ffmpeg')
+    parent_dir = os.path.dirname(ffmpeg_path) if ffmpeg_path is not None else None
+    if parent_dir is not None:
         print(f'FFMPEG found in {parent_dir}')
-        return parent_dir
-    except Exception:
+    else:
         print("Couldn't find FFMPEG.")
-        return None
+    return parent_dir
+
+class StartupProfiler():
+    '''
+    Records named phases of application startup; report() prints them against STARTUP_BUDGET.
+    '''
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.marks = []
+
+    def mark(self, phase):
+        self.marks.append((phase, time.perf_counter()))
+
+    def report(self):
+        print('Startup profile:')
+        t_prev = self.t0
+        for phase, t in self.marks:
+            print(f'  {phase:<24s} {(t - t_prev)*1000:8.1f} ms')
+            t_prev = t
+        total = t_prev - self.t0
+        print(f'  {"total":<24s} {total*1000:8.1f} ms ({"within" if total <= STARTUP_BUDGET else "OVER"} budget of {STARTUP_BUDGET*1000:.0f} ms)')
+        return total
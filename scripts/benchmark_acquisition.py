@@ -0,0 +1,34 @@
+#%%
+# Compares CPU use and frame delivery latency of event-driven and polling acquisition on one camera.
+import argparse
+import time
+from jackfish.devices.cameras.flir import FlirCam
+
+parser = argparse.ArgumentParser(description='Benchmark image event vs. polling acquisition.')
+parser.add_argument('--serial_number', default=None, help='Camera serial number (default: first camera)')
+parser.add_argument('--attrs_json', default=None, help='Camera attrs json')
+parser.add_argument('--duration', type=float, default=10, help='Seconds to acquire in each mode')
+args = parser.parse_args()
+
+cam = FlirCam(serial_number=args.serial_number if args.serial_number is not None else 0, attrs_json_fn=args.attrs_json)
+
+for mode in FlirCam.ACQUISITION_MODES:
+    if mode == 'event':
+        cam.register_event_handler()
+    else:
+        cam.unregister_event_handler()
+
+    cam.start()
+    cam.start_preview()
+    time.sleep(args.duration)
+    cam.stop_preview()
+    time.sleep(0.5) # let the acquisition thread finish
+    cam.stop()
+
+    stats = cam.get_acquisition_stats()
+    print(f"{stats['acquisition_mode']:>5}: {cam.frame_num} frames, CPU {stats['acquisition_cpu']*100:.1f}% of a core, "
+          f"latency mean {stats['mean_latency']*1000:.2f} ms / max {stats['max_latency']*1000:.2f} ms, "
+          f"{stats['timeouts']} timeouts")
+
+cam.close()
+# %%
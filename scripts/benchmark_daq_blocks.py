@@ -0,0 +1,66 @@
+#%%
+# Compares the per-read work of the original LabJack stream loop (list counting, savetxt, deque.extend, str-encoded socket data)
+# with NumPy-native blocks (one conversion, vectorized skip count, binary block write, ring buffer preview, raw socket bytes).
+# No device needed: eStreamRead buffers are simulated as lists of floats.
+import os
+import argparse
+import tempfile
+import time
+from collections import deque
+import numpy as np
+
+from jackfish.devices.daqs.stream_blocks import block_from_read, count_skipped_scans, SampleRing
+from jackfish.devices.daqs.daq_data import DaqBlockWriter
+
+parser = argparse.ArgumentParser(description='Benchmark LabJack stream block handling.')
+parser.add_argument('--sample_rate', type=int, default=100000, help='samples/s over all channels')
+parser.add_argument('--n_channels', type=int, default=4)
+parser.add_argument('--reads_per_sec', type=int, default=10)
+parser.add_argument('--n_reads', type=int, default=50)
+parser.add_argument('--preview_sec', type=int, default=15)
+args = parser.parse_args()
+
+scan_rate = args.sample_rate // args.n_channels
+scans_per_read = scan_rate // args.reads_per_sec
+rng = np.random.default_rng(0)
+reads = [rng.normal(size=scans_per_read * args.n_channels).tolist() for _ in range(4)]
+tmp_dir = tempfile.mkdtemp()
+
+def original_loop(n_reads):
+    preview_queue = deque([0] * (args.preview_sec * scan_rate * args.n_channels), maxlen=args.preview_sec * scan_rate * args.n_channels)
+    with open(os.path.join(tmp_dir, 'original.jfdaqdata'), 'w') as f:
+        for i in range(n_reads):
+            data = reads[i % len(reads)]
+            cur_skip = data.count(-9999.0)
+            data_to_send = bytes(str(data), 'utf-8')
+            data_2d = np.asarray(data).reshape((-1, args.n_channels))
+            np.savetxt(f, data_2d, fmt='%.18e', newline='\n')
+            preview_queue.extend(data)
+
+def numpy_loop(n_reads):
+    preview_ring = SampleRing(args.n_channels, args.preview_sec * scan_rate)
+    writer = DaqBlockWriter(os.path.join(tmp_dir, 'numpy.jfdaqdata'), {}, args.n_channels, scans_per_read)
+    for i in range(n_reads):
+        data = block_from_read(reads[i % len(reads)], args.n_channels)
+        cur_skip = count_skipped_scans(data)
+        data_to_send = data.T.tobytes()
+        writer.write(data, i * scans_per_read, time.time())
+        preview_ring.write(data)
+    writer.close()
+
+read_period = 1 / args.reads_per_sec
+print(f"{args.sample_rate} samples/s: {args.n_channels} channels x {scan_rate} scans/s, {scans_per_read} scans per read ({read_period*1000:.0f} ms between reads)")
+for name, loop in [('original', original_loop), ('numpy', numpy_loop)]:
+    loop(2)
+    t0 = time.perf_counter()
+    loop(args.n_reads)
+    per_read = (time.perf_counter() - t0) / args.n_reads
+    size = os.path.getsize(os.path.join(tmp_dir, f'{name}.jfdaqdata'))
+    print(f"{name:>8s}: {per_read*1000:7.2f} ms per read ({per_read/read_period*100:5.1f}% of the read period), {size/args.n_reads/2**10:.0f} kB written per read")
+
+for name, convert in [('np.asarray', np.asarray), ('np.fromiter', lambda data: block_from_read(data, args.n_channels))]:
+    t0 = time.perf_counter()
+    for i in range(args.n_reads):
+        convert(reads[i % len(reads)])
+    print(f"{name:>12s} conversion: {(time.perf_counter() - t0) / args.n_reads * 1000:.3f} ms per read")
+# %%
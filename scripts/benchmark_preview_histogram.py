@@ -0,0 +1,37 @@
+#%%
+# Compares pyqtgraph's full-frame histogram (computed on every setImage) with the sampled bincount histogram used for the camera preview.
+import argparse
+import time
+import numpy as np
+import pyqtgraph as pg
+
+from jackfish.preview_histogram import sampled_histogram, percentile_levels
+
+parser = argparse.ArgumentParser(description='Benchmark preview histogram computation.')
+parser.add_argument('--n_repeat', type=int, default=50)
+parser.add_argument('--stride', type=int, default=4)
+args = parser.parse_args()
+
+app = pg.mkQApp()
+
+def time_it(fn, n_repeat):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(n_repeat):
+        fn()
+    return (time.perf_counter() - t0) / n_repeat
+
+rng = np.random.default_rng(0)
+for (y, x) in [(540, 720), (1080, 1440), (2048, 2448)]:
+    frame = rng.normal(80, 20, size=(y, x)).clip(0, 255).astype(np.uint8)
+    image_item = pg.ImageItem(frame.T)
+
+    t_pg = time_it(image_item.getHistogram, args.n_repeat)
+    t_full = time_it(lambda: sampled_histogram(frame, stride=1), args.n_repeat)
+    t_sampled = time_it(lambda: percentile_levels(sampled_histogram(frame, stride=args.stride)), args.n_repeat)
+
+    levels_full = percentile_levels(sampled_histogram(frame, stride=1))
+    levels_sampled = percentile_levels(sampled_histogram(frame, stride=args.stride))
+    print(f"{x}x{y}: pyqtgraph {t_pg*1000:.2f} ms, bincount full {t_full*1000:.2f} ms, "
+          f"bincount stride {args.stride} + levels {t_sampled*1000:.2f} ms; levels full {levels_full} vs sampled {levels_sampled}")
+# %%
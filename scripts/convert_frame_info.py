@@ -0,0 +1,12 @@
+#%%
+# Converts .txt frame info files of camera recordings in an experiment directory to binary .jfmeta files.
+import argparse
+from jackfish.devices.cameras.frame_metadata import convert_frame_info_dir
+
+parser = argparse.ArgumentParser(description='Convert jackfish .txt frame info files to .jfmeta.')
+parser.add_argument('dir', help='Directory containing camera videos and their .txt frame info files')
+args = parser.parse_args()
+
+for out_path in convert_frame_info_dir(args.dir):
+    print(f'Wrote {out_path}')
+# %%
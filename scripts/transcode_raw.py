@@ -0,0 +1,15 @@
+#%%
+# Transcodes raw (.jfraw) camera recordings in an experiment directory to H.264 mp4s.
+import argparse
+from jackfish.devices.cameras.raw_video import transcode_raw_dir
+
+parser = argparse.ArgumentParser(description='Transcode jackfish raw videos to H.264.')
+parser.add_argument('dir', help='Directory containing .jfraw files')
+parser.add_argument('--preset', default='medium', help='libx264 preset')
+parser.add_argument('--crf', type=int, default=17)
+parser.add_argument('--ffmpeg_location', default=None, help='Directory containing the ffmpeg binary')
+parser.add_argument('--remove_raw', action='store_true', help='Delete each raw file after it is transcoded successfully')
+args = parser.parse_args()
+
+transcode_raw_dir(args.dir, preset=args.preset, crf=args.crf, ffmpeg_location=args.ffmpeg_location, remove_raw=args.remove_raw)
+# %%
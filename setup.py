@@ -19,8 +19,7 @@ setup(
         'simple-pyspin',
         'numpy',
         'matplotlib',
-        'labjack-ljm',
-        'scikit-video'],
+        'labjack-ljm'],
     include_package_data=True,
     zip_safe=False
 )